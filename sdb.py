@@ -1,10 +1,16 @@
 from __future__ import print_function
 
+import binascii
 import cmd
 import contextlib
 import errno
+import fcntl
+import functools
+import hashlib
+import json
 import logging
 import os
+import pickle
 import pprint
 import re
 import rlcompleter
@@ -12,13 +18,17 @@ import select
 import signal
 import socket
 import sys
+import tempfile
+import time
 import termios
 import threading
 import traceback
 import tty
+from collections import OrderedDict
 from multiprocessing import process
 from pdb import Pdb
 import six
+from six.moves import _thread
 from six.moves.queue import Queue, Empty
 from pygments import highlight
 from pygments.lexers import PythonLexer
@@ -26,23 +36,53 @@ from pygments.formatters import Terminal256Formatter
 
 
 __all__ = (
-    'SDB_HOST', 'SDB_PORT', 'SDB_NOTIFY_HOST', 'SDB_COLORIZE',
-    'DEFAULT_PORT', 'Sdb', 'debugger', 'set_trace',
+    'SDB_HOST', 'SDB_PORT', 'SDB_NOTIFY_HOST', 'SDB_COLORIZE', 'SDB_DELTA',
+    'SDB_DELTA_ROWS', 'SDB_BUDGET', 'SDB_AGENT_PORT', 'DEFAULT_PORT', 'Sdb',
+    'debugger', 'set_trace', 'post_mortem', 'PostMortem', 'install_excepthook',
+    'debug_errors', 'EvaluationInterrupted', 'enable_agent', 'break_into',
 )
 
 DEFAULT_PORT = 6899
 
+#: Where `sdb-listen` listens for the ports of new sessions.
+NOTIFY_PORT = 6899
+
 SDB_HOST = os.environ.get('SDB_HOST') or '127.0.0.1'
 SDB_PORT = int(os.environ.get('SDB_PORT') or DEFAULT_PORT)
 SDB_NOTIFY_HOST = os.environ.get('SDB_NOTIFY_HOST') or '127.0.0.1'
 SDB_CONTEXT_LINES = os.environ.get('SDB_CONTEXT_LINES') or 60
 SDB_COLORIZE = bool(int(os.environ.get('SDB_COLORIZE') or 1))
+SDB_DELTA = bool(int(os.environ.get('SDB_DELTA') or 0))
+SDB_DELTA_ROWS = int(os.environ.get('SDB_DELTA_ROWS') or 24)
+SDB_DUMP_CHUNK = int(os.environ.get('SDB_DUMP_CHUNK') or 64 * 1024)
+SDB_BUDGET = float(os.environ.get('SDB_BUDGET') or 0)
+SDB_AGENT_PORT = int(os.environ.get('SDB_AGENT_PORT') or DEFAULT_PORT - 1)
+SDB_POST_MORTEM_DIR = os.environ.get('SDB_POST_MORTEM_DIR', os.path.join(
+    tempfile.gettempdir(), 'sdb-post-mortem-%d' % os.getuid()
+))
 
 #: Holds the currently active debugger.
 _current = [None]
 
+#: Holds the `PostMortem` handler shared by the excepthooks and
+#: `debug_errors`.
+_post_mortem = [None]
+
+#: Holds the running `Agent`, if any.
+_agent = [None]
+
+#: Set by `break_into()` right before it sends the main thread `SIGTRAP`,
+#: so that the agent's handler can tell its own signals apart.
+_break_pending = [False]
+
 _frame = getattr(sys, '_getframe')
 
+_get_ident = _thread.get_ident
+
+#: Maps thread idents to the (stdin, stdout) their I/O is routed to.
+_routes = {}
+_routes_lock = threading.Lock()
+
 NO_AVAILABLE_PORT = """\
 Couldn't find an available port.
 
@@ -57,9 +97,47 @@ Type `exit` in session to continue.
 {self.ident}: Waiting for client...
 """
 
+AGENT_BANNER = """\
+{self.me}:{self.port}: Ready to attach: telnet {self.host} {self.port}
+"""
+
+AGENT_HELP = """\
+Commands:
+  threads        list threads and their current stacks
+  break <n>      break into thread <n> (its number or ident) at its next line
+  quit           disconnect from the agent
+"""
+
 SESSION_STARTED = '{self.ident}: Now in session with {self.remote_addr}.'
 SESSION_ENDED = '{self.ident}: Session with {self.remote_addr} ended.'
 
+#: Framing for `dump`: a header line, then length-prefixed chunks, ending
+#: with an empty chunk.  The header carries the nonce `sdb-listen` sent
+#: with the command, so output that merely contains the marker is never
+#: taken for a dump.
+DUMP_HEADER = b'<!DUMP!>'
+DUMP_CHUNK = b'<!CHUNK!>'
+DUMP_NONCE = '<!NONCE!>'
+
+#: Prefixes a machine-readable query from a programmatic client (see
+#: `sdb_client`), and the single line of JSON that answers it.
+QUERY = '<!QUERY!>'
+QUERY_RESULT = '<!RESULT!>'
+
+#: Answers are sent to every session at once, so they're kept small: the
+#: `repr` is cut to `QUERY_REPR_LIMIT` characters, and the `value` is left
+#: out if its JSON is longer than `QUERY_VALUE_LIMIT`.
+QUERY_REPR_LIMIT = 200
+QUERY_VALUE_LIMIT = 4096
+
+#: Sent by the client to interrupt the command that's running.
+INTERRUPT = b'<!INT!>\n'
+
+#: Telnet "Interrupt Process" (what `telnet` sends on Ctrl-C), and the
+#: "DO TIMING-MARK" that usually follows it.
+TELNET_IP = b'\xff\xf4'
+TELNET_DO_TM = b'\xff\xfd\x06'
+
 
 class SocketCompleter(rlcompleter.Completer):
 
@@ -76,23 +154,395 @@ class SocketCompleter(rlcompleter.Completer):
         return matches
 
 
+class ThreadRouter(object):
+    """Stands in for `sys.stdin` or `sys.stdout` while sessions are open.
+
+    I/O from a thread that is being debugged goes to its session; every
+    other thread passes straight through to the original stream, so
+    unrelated `print` calls and log handlers never block on (or pollute)
+    the debug socket.
+    """
+
+    def __init__(self, stream, index):
+        self.stream = stream
+        self._index = index
+
+    def _target(self):
+        route = _routes.get(_get_ident())
+        if route is None:
+            return self.stream
+        return route[self._index]
+
+    def write(self, data):
+        return self._target().write(data)
+
+    def flush(self):
+        return self._target().flush()
+
+    def readline(self, *args):
+        return self._target().readline(*args)
+
+    # special methods are looked up on the type, bypassing `__getattr__`
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._target())
+    next = __next__
+
+    def __enter__(self):
+        return self._target().__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._target().__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+def _route(stdin, stdout):
+    """Route the current thread's standard streams; returns the previous
+    route, to be handed back to `_unroute`."""
+    ident = _get_ident()
+    with _routes_lock:
+        for name, index in (('stdin', 0), ('stdout', 1)):
+            stream = getattr(sys, name)
+            if not isinstance(stream, ThreadRouter):
+                setattr(sys, name, ThreadRouter(stream, index))
+        previous = _routes.get(ident)
+        _routes[ident] = (stdin, stdout)
+    return ident, previous
+
+
+def _unroute(route):
+    ident, previous = route
+    with _routes_lock:
+        if previous is None:
+            _routes.pop(ident, None)
+        else:
+            _routes[ident] = previous
+        if not _routes:
+            for name in ('stdin', 'stdout'):
+                stream = getattr(sys, name)
+                if isinstance(stream, ThreadRouter):
+                    setattr(sys, name, stream.stream)
+
+
+class EvaluationInterrupted(KeyboardInterrupt):
+    """Raised in the debugged thread to abort the command it's running."""
+
+
+def _raise_in_thread(ident, exc):
+    """Asynchronously raise `exc` (a class, or None to cancel a pending
+    one) in the thread identified by `ident`."""
+    import ctypes
+    if sys.version_info >= (3, 7):
+        ident = ctypes.c_ulong(ident)
+    else:
+        ident = ctypes.c_long(ident)
+    if exc is not None:
+        exc = ctypes.py_object(exc)
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(ident, exc)
+
+
+class Watchdog(threading.Thread):
+    """Aborts the command a thread is running when its time `budget` (in
+    seconds) runs out, or when the client on `sock` sends an interrupt.
+
+    The interrupt is delivered as an `EvaluationInterrupted` raised in the
+    debugged thread, at most once; code blocked in C (e.g., a long
+    `time.sleep()`) only sees it once it returns to Python.  After `defer()`
+    nothing is raised, and the thread checks `fired` itself instead.
+    """
+
+    poll = 0.05
+    deferred = False
+
+    def __init__(self, target, budget=0, sock=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.target = target
+        self.budget = budget
+        self.sock = sock
+        self.fired = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        deadline = time.time() + self.budget if self.budget else None
+        while not self._done.is_set():
+            wait = self.poll
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.fire('budget of %gs exceeded' % self.budget)
+                    return
+                wait = min(wait, remaining)
+            if self.sock is None:
+                self._done.wait(wait)
+                continue
+            try:
+                r, _, _ = select.select([self.sock], [], [], wait)
+                pending = self.sock.recv(64, socket.MSG_PEEK) if r else None
+            except (socket.error, select.error, ValueError):
+                # the session was closed (e.g., by `continue`)
+                return
+            if pending == b'':
+                # the client went away; the session notices on its own
+                self.sock = None
+            elif pending:
+                length = self._interrupt_length(pending)
+                if length:
+                    self.fire('interrupted', length)
+                    return
+                # input for a later command; don't spin on it
+                self._done.wait(wait)
+
+    def _interrupt_length(self, pending):
+        for marker in (INTERRUPT, TELNET_IP):
+            if pending.startswith(marker):
+                length = len(marker)
+                if pending[length:].startswith(TELNET_DO_TM):
+                    length += len(TELNET_DO_TM)
+                return length
+        return 0
+
+    def fire(self, reason, consume=0):
+        with self._lock:
+            if self._done.is_set() or self.fired:
+                # once stopped, an interrupt is left for the next command
+                return
+            if consume:
+                self.sock.recv(consume)
+            self.fired = reason
+            if not self.deferred:
+                _raise_in_thread(self.target, EvaluationInterrupted)
+
+    def defer(self):
+        with self._lock:
+            self.deferred = True
+            if self.fired:
+                # cancel the exception if it hasn't been delivered yet
+                _raise_in_thread(self.target, None)
+
+    def stop(self):
+        with self._lock:
+            self._done.set()
+            if self.fired:
+                # cancel the exception if it hasn't been delivered yet
+                _raise_in_thread(self.target, None)
+
+
+class DumpWriter(object):
+    """File-like object that streams whatever is written to it over `sock`
+    in chunks of at most `chunk_size` bytes.
+
+    Large writes (e.g., a `memoryview` of an array, or the payload of a big
+    `bytes` object from `pickle`) are sent as slices without being copied;
+    small ones are coalesced, so memory use stays at one chunk however big
+    the object is.  Writes raise `EvaluationInterrupted` between chunks once
+    `interrupted()` returns true; `close()` always ends the stream.
+    """
+
+    def __init__(self, sock, nonce, total=-1, chunk_size=SDB_DUMP_CHUNK,
+                 interrupted=None):
+        self.sock = sock
+        self.chunk_size = chunk_size
+        self.interrupted = interrupted
+        self.sent = 0
+        self._buff = bytearray()
+        self.sock.sendall(
+            DUMP_HEADER + ('%s %d\n' % (nonce, total)).encode('utf-8')
+        )
+
+    def write(self, data):
+        view = memoryview(data)
+        if len(self._buff) + len(view) < self.chunk_size:
+            self._buff.extend(view)
+            return len(view)
+        for i in range(0, len(view), self.chunk_size):
+            if self.interrupted is not None and self.interrupted():
+                raise EvaluationInterrupted
+            if not i:
+                self.flush()
+            self._send(view[i:i + self.chunk_size])
+        return len(view)
+
+    def flush(self):
+        if self._buff:
+            self._send(self._buff)
+            del self._buff[:]
+
+    def close(self):
+        self.flush()
+        self._send(b'')
+
+    def _send(self, chunk):
+        self.sock.sendall(DUMP_CHUNK + ('%d\n' % len(chunk)).encode('ascii'))
+        if len(chunk):
+            self.sock.sendall(chunk)
+        self.sent += len(chunk)
+
+
+class Screen(object):
+    """Tracks the listing the client last displayed.
+
+    Rather than resending the full listing on every step, `render` returns
+    the smallest sequence of ANSI escapes that brings the client's terminal
+    up to date: the changed rows (e.g., the current-line marker) and,
+    when the window has moved within the same file, a scroll of the
+    viewport.  The listing is anchored at the top of the terminal, so
+    whatever is drawn must fit in `height` rows; anything else written to
+    the client invalidates it (see `dirty`).
+    """
+
+    def __init__(self, height=SDB_DELTA_ROWS):
+        self.height = height
+        self.key = None
+        self.first = None
+        self.rows = []
+        self.dirty = True
+
+    def invalidate(self):
+        self.dirty = True
+
+    def render(self, key, first, rows):
+        old, old_first = self.rows, self.first
+        full = (
+            self.dirty or key != self.key or not old or
+            abs(first - old_first) >= max(len(old), len(rows))
+        )
+        self.key, self.first, self.rows = key, first, list(rows)
+        self.dirty = False
+
+        if full:
+            return '\x1b[H\x1b[2J' + ''.join(r + '\n' for r in rows)
+
+        out = []
+        shift = first - old_first
+        if shift:
+            # scroll the listing region, then diff against what's left
+            height = max(len(old), len(rows))
+            out.append('\x1b[1;%dr' % height)
+            if shift > 0:
+                out.append('\x1b[%dS' % shift)
+                old = old[shift:]
+            else:
+                out.append('\x1b[%dT' % -shift)
+                old = [''] * -shift + old
+            out.append('\x1b[r')
+        for i, row in enumerate(rows):
+            if i >= len(old) or old[i] != row:
+                out.append('\x1b[%d;1H\x1b[2K%s' % (i + 1, row))
+        # park the cursor below the listing and clear stale output
+        out.append('\x1b[%d;1H\x1b[J' % (len(rows) + 1))
+        return ''.join(out)
+
+
+class _WriteTracker(object):
+    """Wraps a stream and invalidates a `Screen` whenever it's written to."""
+
+    def __init__(self, stream, screen):
+        self._stream = stream
+        self._screen = screen
+
+    def write(self, data):
+        if data:
+            self._screen.invalidate()
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def collapse_stack(stack, current=None, max_period=8, min_repeats=3):
+    """Group a `stack` of (frame, lineno) pairs into rows.
+
+    Each row is a ``(first, last, period)`` range of frame indices: a single
+    frame has a period of 1, while runs of frames that repeat the same
+    `period` frames (same code objects, same line numbers) at least
+    `min_repeats` times are folded into one row.  The `current` frame is
+    never folded away.  Nothing is formatted here, so this stays cheap for
+    stacks thousands of frames deep.
+    """
+    keys = [(frame.f_code, lineno) for frame, lineno in stack]
+    n = len(keys)
+    rows = []
+    i = 0
+    while i < n:
+        limit = current if current is not None and i < current else n
+        best_period, best_length = 1, 1
+        if i != current:
+            for period in range(1, max_period + 1):
+                j = i
+                while j + period < limit and keys[j] == keys[j + period]:
+                    j += 1
+                length = (j - i + period) // period * period
+                if length // period >= min_repeats and length > best_length:
+                    best_period, best_length = period, length
+        rows.append((i, i + best_length - 1, best_period))
+        i += best_length
+    return rows
+
+
+def _bind(host, port, search_limit=100):
+    """Listen on the first free port from `port` on; returns the socket and
+    its port, or (None, None) if all `search_limit` of them are taken."""
+    for i in range(search_limit):
+        _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        _sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            _sock.bind((host, port + i))
+        except socket.error as exc:
+            _sock.close()
+            if exc.errno in [errno.EADDRINUSE, errno.EINVAL]:
+                continue
+            raise
+        # only announce a port that is ready for clients
+        _sock.listen(1)
+        return _sock, _sock.getsockname()[1]
+    return None, None
+
+
+def _notify(host, port):
+    """Announce a session (or the agent) on `port` to `sdb-listen` on
+    `host`, if any."""
+    if host:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.sendto(str(port).encode('utf-8'), (host, NOTIFY_PORT))
+        finally:
+            sock.close()
+
+
 class Sdb(Pdb):
     """Socket-based debugger."""
 
     me = 'Socket Debugger'
     _prev_outs = None
     _sock = None
+    _handles = ()
+    _watchdog = None
     _completer = SocketCompleter()
 
     def __init__(self, host=SDB_HOST, port=SDB_PORT,
                  notify_host=SDB_NOTIFY_HOST, context_lines=SDB_CONTEXT_LINES,
                  port_search_limit=100, port_skew=+0, out=sys.stdout,
-                 colorize=SDB_COLORIZE, interactive=False):
+                 colorize=SDB_COLORIZE, interactive=False, delta=SDB_DELTA,
+                 budget=SDB_BUDGET, accept_timeout=None, reconnect=False):
         self.active = True
+        self.budget = budget
+        self.accept_timeout = accept_timeout
+        self.reconnect = reconnect
+        self._queried = False
         self.out = out
         self.colorize = colorize
+        self.screen = Screen() if delta else None
+        self._pending_entry = None
 
         self._prev_handles = sys.stdin, sys.stdout
+        self._route = None
 
         self.notify_host = notify_host
         self.context_lines = int(context_lines)
@@ -100,21 +550,15 @@ class Sdb(Pdb):
             host, port, port_search_limit, port_skew,
         )
         self._sock.setblocking(1)
-        self._sock.listen(1)
         self.host = host
         self.port = this_port
         self.ident = '{0}:{1}'.format(self.me, this_port)
 
         self.interactive = interactive
         if self.interactive is False:
-            self.say(BANNER.format(self=self))
-            self._client, address = self._sock.accept()
-            self._client.setblocking(1)
-            self.remote_addr = ':'.join(str(v) for v in address)
-            self.say(SESSION_STARTED.format(self=self))
-
-            self._handle = sys.stdin = sys.stdout = self._client.makefile('rw')
-            Pdb.__init__(self, stdin=self._handle, stdout=self._handle)
+            self._accept()
+            stdin, stdout = self._handles
+            Pdb.__init__(self, stdin=stdin, stdout=stdout)
         else:
             Pdb.__init__(self, stdin=sys.stdin, stdout=sys.stdout)
         self.prompt = ''
@@ -129,32 +573,39 @@ class Sdb(Pdb):
         self._completer.complete(text, 0)
         return self._completer.matches
 
+    def _accept(self):
+        """Wait for a client; raises `socket.timeout` (and closes the
+        session) if none connects within `accept_timeout` seconds."""
+        self.say(BANNER.format(self=self))
+        self._sock.settimeout(self.accept_timeout)
+        try:
+            self._client, address = self._sock.accept()
+        except socket.timeout:
+            self._sock.close()
+            self.active = False
+            raise
+        self._client.setblocking(1)
+        self.remote_addr = ':'.join(str(v) for v in address)
+        self.say(SESSION_STARTED.format(self=self))
+
+        # separate handles: writing to a 'rw' one drops buffered input
+        self._handles = self._client.makefile('r'), self._client.makefile('w')
+        self._route = _route(*self._handles)
+
+    def notify(self, port):
+        _notify(self.notify_host, port)
+
     def get_avail_port(self, host, port, search_limit=100, skew=+0):
         try:
             _, skew = process._current_process.name.split('-')
             skew = int(skew)
         except ValueError:
             pass
-        this_port = None
-        for i in range(search_limit):
-            _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            _sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            this_port = port + skew + i
-            try:
-                _sock.bind((host, this_port))
-            except socket.error as exc:
-                if exc.errno in [errno.EADDRINUSE, errno.EINVAL]:
-                    continue
-                raise
-            else:
-                if self.notify_host:
-                    socket.socket(socket.AF_INET, socket.SOCK_DGRAM).sendto(
-                        str(this_port).encode('utf-8'),
-                        (self.notify_host, 6899)
-                    )
-                return _sock, this_port
-        else:
+        _sock, this_port = _bind(host, port + skew, search_limit)
+        if _sock is None:
             raise Exception(NO_AVAILABLE_PORT.format(self=self))
+        self.notify(this_port)
+        return _sock, this_port
 
     def __enter__(self):
         return self
@@ -163,16 +614,49 @@ class Sdb(Pdb):
         self._close_session()
 
     def _close_session(self):
-        self.stdin, self.stdout = sys.stdin, sys.stdout = self._prev_handles
+        self.stdin, self.stdout = self._prev_handles
+        if self._route is not None:
+            _unroute(self._route)
+            self._route = None
         if not self.interactive and self.active:
-            if self._handle is not None:
-                self._handle.close()
-            if self._client is not None:
-                self._client.close()
+            self._disconnect()
             if self._sock is not None:
                 self._sock.close()
             self.active = False
-            self.say(SESSION_ENDED.format(self=self))
+
+    def _disconnect(self):
+        for handle in self._handles:
+            try:
+                handle.close()
+            except socket.error:
+                pass
+        if self._client is not None:
+            self._client.close()
+        self.say(SESSION_ENDED.format(self=self))
+
+    def do_EOF(self, arg):
+        if self.interactive:
+            return Pdb.do_EOF(self, arg)
+        if not (self.reconnect or self._queried):
+            # the client went away without continuing; carry on
+            return self.do_continue(arg)
+        # a query client (or any client, with `reconnect`) went away, or
+        # its connection was reset; stay paused and wait for another one
+        if self._route is not None:
+            _unroute(self._route)
+        self._disconnect()
+        self.notify(self.port)
+        try:
+            self._accept()
+        except socket.timeout:
+            # nobody came back; let the program carry on
+            self.stdin, self.stdout = self._prev_handles
+            self.set_continue()
+            return 1
+        self.stdin, self.stdout = self._handles
+        if self.screen is not None:
+            self.screen.invalidate()
+        self.do_list(tuple())
 
     def do_continue(self, arg):
         self._close_session()
@@ -190,13 +674,31 @@ class Sdb(Pdb):
         # this raises a BdbQuit exception that we're unable to catch.
         sys.settrace(None)
 
+    def interaction(self, frame, traceback):
+        if self.screen is not None:
+            # the stack entry is drawn below the listing by `do_list`
+            self._pending_entry = True
+        try:
+            return Pdb.interaction(self, frame, traceback)
+        finally:
+            self._pending_entry = None
+
     def cmdloop(self):
         self.do_list(tuple())
-        return cmd.Cmd.cmdloop(self)
+        while True:
+            try:
+                return cmd.Cmd.cmdloop(self)
+            except socket.error:
+                if self.interactive:
+                    raise
+                if self.do_EOF(''):
+                    return
 
     def do_list(self, args):
         lines = self.context_lines
         context = (lines - 2) / 2
+        if not args and self.screen is not None:
+            return self._render_list(context)
         if not args:
             first = max(1, self.curframe.f_lineno - context)
             last = first + context * 2
@@ -211,6 +713,170 @@ class Sdb(Pdb):
             Pdb.do_list(self, args)
     do_l = do_list
 
+    def _render_list(self, context):
+        entry, self._pending_entry = self._pending_entry, None
+        # the listing, the stack entry and the prompt below it must fit on
+        # the screen; once the terminal scrolls, deltas land on the wrong rows
+        below = len(entry.splitlines()) + 1 if entry else 1
+        context = min(context, (self.screen.height - below - 1) // 2)
+        if context < 0:
+            self.screen.invalidate()
+            if entry:
+                self.stdout.write(entry)
+            first = max(1, self.curframe.f_lineno)
+            return self.do_list(six.text_type('%d, %d') % (first, first))
+        first = max(1, self.curframe.f_lineno - context)
+        stdout, self.stdout = self.stdout, six.StringIO()
+        try:
+            last = first + context * 2
+            self.do_list(six.text_type('%d, %d') % (first, last))
+            rows = self.stdout.getvalue().splitlines()
+        finally:
+            self.stdout = stdout
+        key = (self.curframe.f_code.co_filename, id(self.curframe))
+        self.stdout.write(self.screen.render(key, int(first), rows))
+        if entry:
+            self.stdout.write(entry)
+        self.stdout.flush()
+        self.screen.dirty = False
+
+    def do_budget(self, arg):
+        """budget [seconds]
+        Abort any command that runs for longer than [seconds] (0 disables
+        the budget) and report how long each command took.
+        """
+        if arg:
+            try:
+                self.budget = max(float(arg), 0)
+            except ValueError:
+                self.stdout.write('*** Invalid budget (%s)\n' % arg)
+                return
+        self.stdout.write('budget: %s\n' % (
+            '%gs' % self.budget if self.budget else 'none'
+        ))
+
+    def do_dump(self, arg):
+        """dump <expression> <path>
+        Stream the value of the expression to <path> on the sdb-listen
+        client.  Objects that support the buffer protocol (bytes, arrays)
+        are sent as raw bytes, anything else is pickled.
+        """
+        nonce = ''
+        if arg.startswith(DUMP_NONCE):
+            nonce, _, arg = arg[len(DUMP_NONCE):].partition(' ')
+        try:
+            expr, path = arg.rsplit(None, 1)
+        except ValueError:
+            self.stdout.write('*** Usage: dump <expression> <path>\n')
+            return
+        if self.interactive or not nonce:
+            self.stdout.write('*** dump requires a sdb-listen session\n')
+            return
+        try:
+            obj = self._getval(expr)
+        except Exception:
+            return
+
+        try:
+            view = memoryview(obj)
+            data = view.cast('B')
+        except (TypeError, AttributeError):
+            view = data = None
+
+        watchdog = self._watchdog
+        if watchdog is not None:
+            # an interrupt raised between a chunk's header and its payload
+            # would corrupt the stream; the writer checks between chunks
+            watchdog.defer()
+        self.stdout.flush()
+        try:
+            writer = DumpWriter(
+                self._client, nonce, -1 if data is None else len(data),
+                interrupted=lambda: watchdog is not None and watchdog.fired,
+            )
+            try:
+                if data is not None:
+                    writer.write(data)
+                else:
+                    pickle.dump(obj, writer, protocol=pickle.HIGHEST_PROTOCOL)
+            finally:
+                # e.g., an unpicklable object; terminate the stream cleanly
+                writer.close()
+        except EvaluationInterrupted:
+            self.stdout.write('*** dump interrupted after %d bytes; %s is '
+                              'incomplete\n' % (writer.sent, path))
+            raise
+        except socket.error as exc:
+            self.stdout.write('*** dump failed: %s\n' % exc)
+            return
+        except Exception as exc:
+            self.stdout.write('*** dump failed: %r\n' % exc)
+            return
+
+        if view is not None:
+            self.stdout.write(
+                'dumped %d bytes (format %r, shape %r) to %s\n' % (
+                    writer.sent, view.format, view.shape, path
+                )
+            )
+        else:
+            self.stdout.write('dumped %d bytes (pickle) to %s\n' % (
+                writer.sent, path
+            ))
+
+    def do_where(self, arg):
+        """w(here) [frame]
+        Print a page of the stack trace, with the most recent frame at the
+        bottom, starting at [frame] (by default, the page around the current
+        frame).  Recursive segments are collapsed into a single line.
+        """
+        rows = collapse_stack(self.stack, self.curindex)
+        target = self.curindex
+        if arg:
+            try:
+                target = int(arg)
+            except ValueError:
+                target = -1
+            if not 0 <= target < len(self.stack):
+                self.stdout.write('*** Invalid frame (%s)\n' % arg)
+                return
+        for index, (first, last, _) in enumerate(rows):
+            if first <= target <= last:
+                break
+        page = max(self.context_lines, 1)
+        if not arg:
+            index = max(0, index - page // 2)
+        start, end = index, min(index + page, len(rows))
+
+        lines = []
+        if start:
+            lines.append('  ... frames 0-%d not shown (`where 0`)' % (
+                rows[start][0] - 1
+            ))
+        for first, last, period in rows[start:end]:
+            if first == last:
+                frame, lineno = self.stack[first]
+                prefix = '> ' if frame is self.curframe else '  '
+                lines.append(prefix + self.format_stack_entry(
+                    (frame, lineno), '\n-> '
+                ))
+            else:
+                names = [
+                    frame.f_code.co_name
+                    for frame, _ in self.stack[first:first + period]
+                ]
+                lines.append('  frames %d-%d: %dx cycle of %s' % (
+                    first, last, (last - first + 1) // period,
+                    ' -> '.join(names)
+                ))
+        if end < len(rows):
+            lines.append('  ... frames %d-%d not shown (`where %d`)' % (
+                rows[end][0], len(self.stack) - 1, rows[end][0]
+            ))
+        with style(self):
+            self.stdout.write('\n'.join(lines) + '\n')
+    do_w = do_bt = do_where
+
     def format_stack_entry(self, *args, **kwargs):
         entry = Pdb.format_stack_entry(self, *args, **kwargs)
         return '\n'.join(
@@ -218,18 +884,42 @@ class Sdb(Pdb):
         )
 
     def print_stack_entry(self, *args, **kwargs):
+        if self._pending_entry is True:
+            stdout, self.stdout = self.stdout, six.StringIO()
+            try:
+                with style(self):
+                    Pdb.print_stack_entry(self, *args, **kwargs)
+                self._pending_entry = self.stdout.getvalue()
+            finally:
+                self.stdout = stdout
+            return
         with style(self):
             return Pdb.print_stack_entry(self, *args, **kwargs)
 
     def default(self, line):
         with style(self):
-            return Pdb.default(self, line)
+            # `Pdb.default` swaps `sys.stdin`/`sys.stdout` for the duration
+            # of the statement; hand it the routers so that only this
+            # thread's output is captured
+            stdin, stdout = self.stdin, self.stdout
+            route = _route(stdin, stdout)
+            self.stdin, self.stdout = sys.stdin, sys.stdout
+            try:
+                return Pdb.default(self, line)
+            finally:
+                self.stdin, self.stdout = stdin, stdout
+                _unroute(route)
 
     def parseline(self, line):
         line = line.strip()
         match = re.search('^([0-9]+)([a-zA-Z]+.*)', line)
         if match:
             times, command = match.group(1), match.group(2)
+            if six.PY3 and command in ('u', 'up', 'd', 'down'):
+                # move the whole way at once rather than printing every
+                # frame along the way
+                command = '%s %s' % (command, times)
+                times = 1
             line = command
             self.cmdqueue.extend([
                 command for _ in range(int(times) - 1)
@@ -237,6 +927,8 @@ class Sdb(Pdb):
         if line.startswith('lines '):
             try:
                 self.context_lines = int(line.split(' ')[1])
+                if self.screen is not None:
+                    self.screen.height = self.context_lines
                 line = 'l'
             except ValueError:
                 pass
@@ -253,6 +945,12 @@ class Sdb(Pdb):
 
     def onecmd(self, line):
         line = line.strip()
+        if line == INTERRUPT.decode('ascii').strip():
+            # arrived after the command it was meant for had finished
+            return False
+        if line == 'EOF' and not self.interactive:
+            # may wait for the next client, so never under a `Watchdog`
+            return self.do_EOF('')
         if line.endswith('<!TAB!>'):
             line = line.split('<!TAB!>')[0]
             matches = self.complete(line)
@@ -260,8 +958,89 @@ class Sdb(Pdb):
                 self.stdout.write(' '.join(matches))
                 self.stdout.flush()
             return False
+
+        watchdog = None
+        start = time.time()
+        stop = False
+        try:
+            try:
+                if not self.interactive or self.budget:
+                    # started in here, as it may fire right away
+                    watchdog = self._watchdog = Watchdog(
+                        _get_ident(), self.budget,
+                        None if self.interactive else self._client
+                    )
+                    watchdog.start()
+                stop = self._onecmd(line)
+            finally:
+                self._watchdog = None
+                if watchdog is not None:
+                    watchdog.stop()
+        except EvaluationInterrupted:
+            watchdog.stop()
+        if not stop:
+            fired = watchdog is not None and watchdog.fired
+            if self.budget or fired:
+                self.stdout.write('[%.3fs%s]\n' % (
+                    time.time() - start, ', %s' % fired if fired else ''
+                ))
+                self.stdout.flush()
+        return stop
+
+    def _onecmd(self, line):
+        if line.startswith(QUERY):
+            return self._query(line[len(QUERY):])
+        if self.screen is not None:
+            stdout = self.stdout
+            self.stdout = tracker = _WriteTracker(stdout, self.screen)
+            try:
+                return Pdb.onecmd(self, line)
+            finally:
+                # `continue` and `quit` may have swapped the handles already
+                if self.stdout is tracker:
+                    self.stdout = stdout
         return Pdb.onecmd(self, line)
 
+    def _query(self, payload):
+        """Evaluate the expression in a `QUERY` and answer with a single
+        `QUERY_RESULT` line; continues afterwards if asked to `resume`."""
+        self._queried = True
+        request, result = {}, {}
+        try:
+            request = json.loads(payload)
+            result['id'] = request.get('id')
+            frame_locals = getattr(
+                self, 'curframe_locals', self.curframe.f_locals
+            )
+            value = eval(
+                request['expr'], self.curframe.f_globals, frame_locals
+            )
+        except (Exception, EvaluationInterrupted):
+            exc_type, exc = sys.exc_info()[:2]
+            result.update(ok=False, error=traceback.format_exception_only(
+                exc_type, exc
+            )[-1].strip())
+            answer = json.dumps(result)
+        else:
+            text = repr(value)
+            result.update(
+                ok=True, type=type(value).__name__,
+                repr=text[:QUERY_REPR_LIMIT],
+                truncated=len(text) > QUERY_REPR_LIMIT,
+            )
+            answer = json.dumps(result)
+            try:
+                full = json.dumps(dict(result, value=value))
+            except (TypeError, ValueError):
+                pass
+            else:
+                if len(full) - len(answer) <= QUERY_VALUE_LIMIT:
+                    answer = full
+        self.stdout.write(QUERY_RESULT + answer + '\n')
+        self.stdout.flush()
+        if request.get('resume'):
+            return self.do_continue('')
+
     def displayhook(self, obj):
         if obj is not None and not isinstance(obj, list):
             return pprint.pprint(obj)
@@ -316,6 +1095,303 @@ def set_trace(frame=None):
     return debugger().set_trace(frame)
 
 
+def post_mortem(t=None, **kw):
+    """Start a post-mortem session for traceback `t`, or for the exception
+    currently being handled."""
+    if t is None:
+        t = sys.exc_info()[2]
+    if t is None:
+        raise ValueError(
+            'A valid traceback must be passed if no exception is being handled'
+        )
+    p = Sdb(**kw)
+    p.reset()
+    p.interaction(None, t)
+
+
+def fingerprint(tb):
+    """Return a cheap, hashable key for a traceback: the code objects and
+    line numbers along it (no source lookups, no string formatting)."""
+    key = []
+    while tb is not None:
+        key.append((tb.tb_frame.f_code, tb.tb_lineno))
+        tb = tb.tb_next
+    return tuple(key)
+
+
+class PostMortem(object):
+    """Opens post-mortem sessions for unhandled exceptions, within limits.
+
+    Each distinct failure (exception type plus traceback `fingerprint`) gets
+    at most one session, at most `max_sessions` are opened in total, and at
+    most `max_blocked` threads sit in one at a time.  Anything else is
+    recorded in `snapshots` and the worker carries on, so a recurring error
+    can't park every worker in the fleet.
+
+    The limits are shared by every process using the same `shared_dir`
+    (every process on the host, by default; point `SDB_POST_MORTEM_DIR` at
+    a shared mount to cover several hosts), over a sliding `window` of
+    seconds; if the state there can't be used, each process keeps to the
+    limits on its own.  A session that no client connects to within
+    `accept_timeout` seconds is abandoned, and the worker carries on.  The
+    handler never raises.
+    """
+
+    def __init__(self, max_sessions=1, max_blocked=1, max_snapshots=100,
+                 accept_timeout=300, shared_dir=SDB_POST_MORTEM_DIR,
+                 window=600, **kwargs):
+        self.max_sessions = max_sessions
+        self.max_blocked = max_blocked
+        self.max_snapshots = max_snapshots
+        self.accept_timeout = accept_timeout
+        self.shared_dir = shared_dir
+        self.window = window
+        self.kwargs = kwargs
+        self.sessions = 0
+        #: Maps failure keys to compact snapshot dicts, oldest first.
+        self.snapshots = OrderedDict()
+        self._blocked = threading.BoundedSemaphore(max_blocked)
+        self._lock = threading.Lock()
+        self._shared_failed = False
+
+    def __call__(self, exc_type, exc_value, tb):
+        """Handle an exception; returns True if a session was opened."""
+        if exc_type is None or issubclass(
+            exc_type, (KeyboardInterrupt, SystemExit)
+        ):
+            return False
+        key = (exc_type, fingerprint(tb))
+        with self._lock:
+            snapshot = self.record(key, exc_type, exc_value, tb)
+            debug = (
+                snapshot['count'] == 1 and
+                self.sessions < self.max_sessions and
+                self._blocked.acquire(False)
+            )
+            if debug and not self.claim(snapshot):
+                self._blocked.release()
+                debug = False
+            if debug:
+                self.sessions += 1
+                snapshot['debugged'] = True
+        if not debug:
+            if snapshot['count'] == 1:
+                self.say(snapshot)
+            return False
+        try:
+            self.open_session(tb)
+        except socket.timeout:
+            snapshot['timed_out'] = True
+            self.say(snapshot)
+            return False
+        except Exception as exc:
+            # e.g., no port available; never replace the original error
+            logging.warning(
+                'Socket Debugger: no session for %s: %s', snapshot['type'], exc
+            )
+            return False
+        finally:
+            with self._lock:
+                self.unclaim()
+            self._blocked.release()
+        return True
+
+    def record(self, key, exc_type, exc_value, tb):
+        now = time.time()
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            stack = []
+            while tb is not None:
+                code = tb.tb_frame.f_code
+                stack.append((code.co_filename, tb.tb_lineno, code.co_name))
+                tb = tb.tb_next
+            snapshot = self.snapshots[key] = {
+                'digest': hashlib.sha1(repr((
+                    exc_type.__module__, exc_type.__name__, stack
+                )).encode('utf-8')).hexdigest(),
+                'type': exc_type.__name__,
+                'message': six.text_type(exc_value)[:200],
+                'thread': threading.current_thread().name,
+                'stack': stack,
+                'count': 0,
+                'debugged': False,
+                'timed_out': False,
+                'first_seen': now,
+            }
+            while len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False)
+        snapshot['count'] += 1
+        snapshot['last_seen'] = now
+        return snapshot
+
+    def claim(self, snapshot):
+        """Claim a session for `snapshot` among every process sharing
+        `shared_dir`; returns False if the limits don't allow one."""
+        if not self.shared_dir:
+            return True
+        try:
+            with self._shared_state() as state:
+                if (
+                    snapshot['digest'] in state['failures'] or
+                    len(state['sessions']) >= self.max_sessions or
+                    len(state['blocked']) >= self.max_blocked
+                ):
+                    return False
+                now = time.time()
+                state['failures'][snapshot['digest']] = now
+                state['sessions'].append(now)
+                state['blocked'][self._blocker()] = now
+        except (IOError, OSError) as exc:
+            # the process' own limits (already checked) still apply
+            self._shared_error(exc)
+        return True
+
+    def unclaim(self):
+        if not self.shared_dir:
+            return
+        try:
+            with self._shared_state() as state:
+                state['blocked'].pop(self._blocker(), None)
+        except (IOError, OSError) as exc:
+            self._shared_error(exc)
+
+    def _shared_error(self, exc):
+        if not self._shared_failed:
+            self._shared_failed = True
+            logging.warning(
+                'Socket Debugger: post-mortem limits are per process, as '
+                '%s is unusable: %s', self.shared_dir, exc
+            )
+
+    def _blocker(self):
+        return '%s:%d:%d' % (socket.gethostname(), os.getpid(), _get_ident())
+
+    @contextlib.contextmanager
+    def _shared_state(self):
+        """Lock and load the state shared through `shared_dir`, dropping
+        whatever fell out of the window (or belongs to a dead process);
+        changes are saved on exit."""
+        try:
+            os.makedirs(self.shared_dir, 0o700)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        path = os.path.join(self.shared_dir, 'post-mortem.json')
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                try:
+                    state = json.loads(f.read() or '{}')
+                except ValueError:
+                    state = {}
+                since = time.time() - self.window
+                state = {
+                    'failures': dict(
+                        (digest, seen)
+                        for digest, seen in state.get('failures', {}).items()
+                        if seen > since
+                    ),
+                    'sessions': [
+                        seen for seen in state.get('sessions', [])
+                        if seen > since
+                    ],
+                    'blocked': dict(
+                        (blocker, seen)
+                        for blocker, seen in state.get('blocked', {}).items()
+                        if seen > since and _alive(blocker)
+                    ),
+                }
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def open_session(self, tb):
+        post_mortem(tb, accept_timeout=self.accept_timeout, **self.kwargs)
+
+    def say(self, snapshot):
+        filename, lineno, name = snapshot['stack'][-1]
+        logging.warning(
+            'Socket Debugger: %s %s in %s (%s:%d, %s)',
+            'no client for' if snapshot['timed_out'] else 'not debugging',
+            snapshot['type'], snapshot['thread'], filename, lineno, name,
+        )
+
+
+def _alive(blocker):
+    """Whether the process behind a `PostMortem` blocker key may still be
+    running (processes on other hosts are assumed to be)."""
+    host, pid, _ = blocker.rsplit(':', 2)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except OSError as exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+
+def install_excepthook(**kwargs):
+    """Open post-mortem sessions for unhandled exceptions in the main thread
+    (`sys.excepthook`) and in other threads (`threading.excepthook`).
+
+    Keyword arguments configure the `PostMortem` handler, which is returned.
+    The previous hooks still run first, so tracebacks are printed as usual.
+    """
+    handler = _post_mortem[0] = PostMortem(**kwargs)
+    prev_excepthook = sys.excepthook
+
+    def excepthook(exc_type, exc_value, tb):
+        prev_excepthook(exc_type, exc_value, tb)
+        handler(exc_type, exc_value, tb)
+    sys.excepthook = excepthook
+
+    if hasattr(threading, 'excepthook'):
+        prev_threading_excepthook = threading.excepthook
+
+        def threading_excepthook(args):
+            prev_threading_excepthook(args)
+            handler(args.exc_type, args.exc_value, args.exc_traceback)
+        threading.excepthook = threading_excepthook
+    return handler
+
+
+class debug_errors(object):
+    """Open a post-mortem session if the wrapped block or function raises.
+
+    Usable as a context manager or a decorator; the exception is re-raised
+    afterwards.  Uses the handler from `install_excepthook` (or a default
+    one) unless `handler` is given, so the same limits apply everywhere.
+    """
+
+    def __init__(self, handler=None):
+        self.handler = handler
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            handler = self.handler
+            if handler is None:
+                handler = _post_mortem[0]
+                if handler is None:
+                    handler = _post_mortem[0] = PostMortem()
+            handler(exc_type, exc_value, tb)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
 def sigtrap(*args, **kw):
     signal.signal(
         signal.SIGTRAP,
@@ -323,6 +1399,241 @@ def sigtrap(*args, **kw):
     )
 
 
+def break_into(ident, **kw):
+    """Break into the thread identified by `ident` at the next line it runs
+    in its current frame (or, should that return first, in a caller).
+
+    The thread opens an `Sdb` session (created with `kw`) just like
+    `set_trace()` would.  On Python 3.12+ this works for any thread; older
+    versions can only break into the main thread, via the `SIGTRAP`
+    handler that `enable_agent()` installs (`RuntimeError` is raised if it
+    isn't installed, rather than letting the signal kill the process).
+    """
+    frame = sys._current_frames().get(ident)
+    if frame is None:
+        raise ValueError('No such thread: %s' % ident)
+
+    if not hasattr(sys, 'monitoring'):
+        main = getattr(threading, 'main_thread', lambda: None)()
+        if main is None or main.ident != ident:
+            raise NotImplementedError(
+                'Breaking into threads other than the main thread '
+                'requires Python 3.12'
+            )
+        if not getattr(signal.getsignal(signal.SIGTRAP), 'sdb_agent', False):
+            raise RuntimeError(
+                'Breaking into the main thread requires enable_agent() to '
+                'be called from it first'
+            )
+        _break_pending[0] = True
+        os.kill(os.getpid(), signal.SIGTRAP)
+        return
+
+    monitoring = sys.monitoring
+    for tool in (monitoring.DEBUGGER_ID, 3, 4):
+        try:
+            monitoring.use_tool_id(tool, 'sdb')
+            break
+        except ValueError:
+            continue
+    else:
+        raise RuntimeError('No sys.monitoring tool is free')
+
+    # the chosen frame, then its callers in case it returns first; only
+    # their code is instrumented, and no thread's tracer is touched
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    codes = set(f.f_code for f in frames)
+    lock = threading.Lock()
+
+    def line(code, lineno):
+        current = _frame(1)
+        if current not in frames:
+            return
+        with lock:
+            if not frames:
+                return
+            del frames[:]
+            for each in codes:
+                monitoring.set_local_events(tool, each, 0)
+            monitoring.register_callback(tool, monitoring.events.LINE, None)
+            monitoring.free_tool_id(tool)
+        debugger = Sdb(**kw)
+        debugger.set_trace(current)
+        # stop at the frame's next line, not inside whatever it calls first
+        debugger.set_next(current)
+
+    monitoring.register_callback(tool, monitoring.events.LINE, line)
+    for code in codes:
+        monitoring.set_local_events(tool, code, monitoring.events.LINE)
+
+
+class Agent(threading.Thread):
+    """Lets an operator break into any thread of a running process.
+
+    The agent thread sits in `accept()` until someone connects; nothing is
+    traced, and no other thread pays for it, until a thread is chosen with
+    `break`.  The sessions it opens are created with `Sdb(**session)`.
+    """
+
+    me = 'Socket Debugger Agent'
+
+    def __init__(self, host=SDB_HOST, port=SDB_AGENT_PORT, session=None,
+                 port_search_limit=100, notify_host=None):
+        threading.Thread.__init__(self, name='sdb-agent')
+        self.daemon = True
+        self.session = session or {}
+        self.notify_host = notify_host
+        self._sock, self.port = self.get_avail_port(
+            host, port, port_search_limit
+        )
+        self.host = host
+
+    def get_avail_port(self, host, port, search_limit=100):
+        """Bind the first free port from `port` on (another process, or a
+        forked child, may already have the default one) and announce it to
+        `notify_host`, like `Sdb` sessions do."""
+        _sock, this_port = _bind(host, port, search_limit if port else 1)
+        if _sock is None:
+            raise Exception(
+                NO_AVAILABLE_PORT.replace('SDB_PORT', 'SDB_AGENT_PORT')
+            )
+        _notify(self.notify_host, this_port)
+        return _sock, this_port
+
+    def run(self):
+        while True:
+            client, address = self._sock.accept()
+            stdin, stdout = client.makefile('r'), client.makefile('w')
+            try:
+                self.serve(stdin, stdout)
+            except socket.error:
+                pass
+            finally:
+                stdin.close()
+                stdout.close()
+                client.close()
+
+    def serve(self, stdin, stdout):
+        stdout.write(self.format_threads() + AGENT_HELP)
+        while True:
+            stdout.write('agent> ')
+            stdout.flush()
+            line = stdin.readline()
+            if not line:
+                return
+            command, _, arg = line.strip().partition(' ')
+            if command in ('q', 'quit', 'exit'):
+                return
+            elif command in ('t', 'threads'):
+                stdout.write(self.format_threads())
+            elif command in ('b', 'break') and arg:
+                stdout.write(self.request_break(arg.strip()))
+            elif command:
+                stdout.write(AGENT_HELP)
+
+    def threads(self):
+        """Return (number, ident, name, frame) for every thread except the
+        agent's."""
+        names, agents = {}, set()
+        for thread in threading.enumerate():
+            names[thread.ident] = thread.name
+            if isinstance(thread, Agent):
+                agents.add(thread.ident)
+        frames = sys._current_frames()
+        return [
+            (number, ident, names.get(ident, '?'), frames[ident])
+            for number, ident in enumerate(sorted(
+                i for i in frames if i not in agents
+            ))
+        ]
+
+    def format_threads(self):
+        out = []
+        for number, ident, name, frame in self.threads():
+            out.append('[%d] Thread %d (%s):\n' % (number, ident, name))
+            out.extend(traceback.format_stack(frame, limit=10))
+        return ''.join(out)
+
+    def request_break(self, arg):
+        for number, ident, name, _ in self.threads():
+            if arg in (str(number), str(ident)):
+                break
+        else:
+            return '*** No such thread: %s\n' % arg
+        try:
+            break_into(ident, **self.session)
+        except (ValueError, NotImplementedError, RuntimeError) as exc:
+            return '*** %s\n' % exc
+        return (
+            'Thread %d (%s) will stop at its next line and open a session; '
+            'watch sdb-listen or its log for the port.\n' % (ident, name)
+        )
+
+
+def _chain_sigtrap(session):
+    """Install the `SIGTRAP` handler `break_into()` relies on before Python
+    3.12, keeping the one already installed (e.g., by `sigtrap()`) for the
+    signals that don't come from the agent."""
+    previous = signal.getsignal(signal.SIGTRAP)
+    if getattr(previous, 'sdb_agent', False):
+        previous = previous.previous
+
+    def handler(signum, frame):
+        if _break_pending[0]:
+            _break_pending[0] = False
+        elif callable(previous):
+            return previous(signum, frame)
+        elif previous == signal.SIG_IGN:
+            return
+        Sdb(**session).set_trace(frame)
+
+    handler.sdb_agent = True
+    handler.previous = previous
+    signal.signal(signal.SIGTRAP, handler)
+
+
+def _forget_agent():
+    # a forked child inherits the agent's listening socket, but not its
+    # thread; let go of the port so that `enable_agent()` starts afresh
+    agent, _agent[0] = _agent[0], None
+    if agent is not None:
+        agent._sock.close()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_agent)
+
+
+def enable_agent(host=SDB_HOST, port=SDB_AGENT_PORT, session=None,
+                 notify_host=None):
+    """Start the `Agent` in the background (once per process).
+
+    `session` is a dict of keyword arguments for the `Sdb` sessions it
+    opens.  The agent takes the first free port from `port` on, and
+    announces it to `notify_host` (for `sdb-listen`) if one is given.  On
+    Python < 3.12, call this from the main thread to be able to break into
+    it (a `SIGTRAP` handler is installed for that; signals that don't come
+    from the agent still reach the handler it replaces).
+    """
+    session = session or {}
+    agent = _agent[0]
+    if agent is not None and agent.is_alive():
+        return agent
+    if not hasattr(sys, 'monitoring'):
+        main = getattr(threading, 'main_thread', lambda: None)()
+        if threading.current_thread() is main:
+            _chain_sigtrap(session)
+    agent = _agent[0] = Agent(
+        host, port, session, notify_host=notify_host
+    )
+    agent.start()
+    logging.warning(AGENT_BANNER.format(self=agent))
+    return agent
+
+
 @contextlib.contextmanager
 def style(im_self, filepart=None, lexer=None):
 
@@ -393,19 +1704,25 @@ def style(im_self, filepart=None, lexer=None):
     im_self.stdout = old_stdout
 
 
+def _consume(sock, queue):
+    """Put the port of every session announced on `sock` in `queue`."""
+    print('listening for sdb notifications on :%d...' % NOTIFY_PORT)
+    while True:
+        r, w, x = select.select([sock], [], [])
+        for i in r:
+            data = i.recv(1024)
+            queue.put(data)
+
+
 def listen():
-    queue = Queue()
+    if sys.argv[1:2] == ['query']:
+        from sdb_client import main
+        sys.exit(main(sys.argv[2:]))
 
-    def _consume(queue):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(('0.0.0.0', 6899))
-        print('listening for sdb notifications on :6899...')
-        while True:
-            r, w, x = select.select([sock], [], [])
-            for i in r:
-                data = i.recv(1024)
-                queue.put(data)
-    worker = threading.Thread(target=_consume, args=(queue,))
+    queue = Queue()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('0.0.0.0', NOTIFY_PORT))
+    worker = threading.Thread(target=_consume, args=(sock, queue))
     worker.setDaemon(True)
     worker.start()
 
@@ -421,7 +1738,8 @@ def listen():
                 port = int(port)
                 print('opening telnet session at port :%d...' % port)
                 telnet(port).connect()
-                print('listening for sdb notifications on :6899...')
+                print('listening for sdb notifications on :%d...' %
+                      NOTIFY_PORT)
             except Empty:
                 pass
     except KeyboardInterrupt:
@@ -436,6 +1754,10 @@ class telnet(object):
     line_buff = ''
     completing = None
     history_pos = 0
+    dump = None
+    dump_buff = b''
+    dump_request = None
+    dump_held = b''
 
     def __init__(self, port, stdin=sys.stdin, stdout=sys.stdout):
         self.port = port
@@ -466,11 +1788,42 @@ class telnet(object):
                         self.recv(data)
                     else:
                         self.send()
+            except KeyboardInterrupt:
+                # abort whatever the debugger is running
+                self._send(INTERRUPT)
             except select.error as e:
                 if e[0] != errno.EINTR:
                     raise
 
     def recv(self, data):
+        if self.dump is None and not self.dump_buff:
+            if self.dump_request is None:
+                return self.display(data)
+            # only the header of the dump we asked for starts one
+            data = self.dump_held + data
+            token = DUMP_HEADER + self.dump_request['nonce']
+            text, found, data = data.partition(token)
+            if not found:
+                # hold back what may be the start of a token split in two
+                keep = len(token) - 1
+                while keep and not text.endswith(token[:keep]):
+                    keep -= 1
+                text, self.dump_held = (
+                    text[:len(text) - keep], text[len(text) - keep:]
+                )
+            else:
+                self.dump_held = b''
+            if text:
+                self.display(text)
+            if not found:
+                return
+        data = self.recv_dump(self.dump_buff + data)
+        if data:
+            self.display(data)
+        else:
+            self.stdout.flush()
+
+    def display(self, data):
         if self.completing is not None:
             self.stdout.write('\x1b[2K\r>>> ')
             matches = data.decode('utf-8').split(' ')
@@ -498,6 +1851,78 @@ class telnet(object):
             self.stdout.write('>>> ')
         self.stdout.flush()
 
+    def request_dump(self, line):
+        """Remember the path of a `dump` command typed by the user; returns
+        the command to send, with a nonce for the header to echo."""
+        try:
+            path = line.rsplit(None, 1)[1]
+        except IndexError:
+            return line
+        nonce = binascii.hexlify(os.urandom(8))
+        self.dump_request = {'nonce': nonce, 'path': path}
+        return 'dump %s%s %s' % (
+            DUMP_NONCE, nonce.decode('ascii'), line[len('dump '):]
+        )
+
+    def recv_dump(self, data):
+        """Write the chunks of a `dump` to disk; returns any session output
+        that followed them."""
+        self.dump_buff = b''
+        if self.dump is None:
+            header, newline, rest = data.partition(b'\n')
+            if not newline:
+                self.dump_buff = data
+                return b''
+            path = self.dump_request['path']
+            try:
+                handle = open(path, 'wb')
+            except (IOError, OSError) as exc:
+                self.stdout.write('unable to write %s: %s\n' % (path, exc))
+                handle = None
+            self.dump = {
+                'path': path, 'handle': handle, 'total': int(header),
+                'received': 0, 'remaining': 0,
+            }
+            data = rest
+
+        dump = self.dump
+        while data:
+            if not dump['remaining']:
+                header, newline, rest = data.partition(b'\n')
+                if not newline:
+                    self.dump_buff = data
+                    break
+                data = rest
+                size = int(header[len(DUMP_CHUNK):])
+                if not size:
+                    if dump['handle'] is not None:
+                        dump['handle'].close()
+                    self.dump_progress(dump)
+                    self.stdout.write('\n')
+                    self.dump = self.dump_request = None
+                    return data
+                dump['remaining'] = size
+            chunk = data[:dump['remaining']]
+            data = data[dump['remaining']:]
+            if dump['handle'] is not None:
+                dump['handle'].write(chunk)
+            dump['remaining'] -= len(chunk)
+            dump['received'] += len(chunk)
+        self.dump_progress(dump)
+        return b''
+
+    def dump_progress(self, dump):
+        if dump['total'] >= 0:
+            progress = '%d/%d bytes (%d%%)' % (
+                dump['received'], dump['total'],
+                100 * dump['received'] // max(dump['total'], 1)
+            )
+        else:
+            progress = '%d bytes' % dump['received']
+        self.stdout.write(
+            '\x1b[2K\rdumping to %s: %s' % (dump['path'], progress)
+        )
+
     def send(self):
         char = self.stdin.read(1)
         if char == '\x1b':
@@ -525,9 +1950,10 @@ class telnet(object):
             self.completing = None
             self.history_pos += 1
             self.history.append(self.line_buff)
-            self._send(
-                self.line_buff.encode('utf-8') + '\n'.encode('utf-8')
-            )
+            line = self.line_buff
+            if line.startswith('dump '):
+                line = self.request_dump(line)
+            self._send(line.encode('utf-8') + '\n'.encode('utf-8'))
             self.line_buff = ''
         elif char == '\t':
             # tab complete
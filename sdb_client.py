@@ -0,0 +1,242 @@
+"""Query many paused `sdb` sessions at once.
+
+    >>> import sdb_client
+    >>> sdb_client.query(['10.0.0.5:6899-6999'], '(job.id, len(batch))')
+    [{'session': '10.0.0.5:6899', 'ok': True, 'value': [1234, 50], ...},
+     ...]
+
+Requires Python 3 (asyncio).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+
+from sdb import QUERY, QUERY_RESULT, SDB_HOST
+
+
+__all__ = ('SessionPool', 'query', 'parse_sessions')
+
+
+def parse_sessions(specs, host=SDB_HOST):
+    """Expand ``host:port``, ``port``, and ``host:first-last`` specs into
+    a list of (host, port) pairs."""
+    sessions = []
+    for spec in specs:
+        if isinstance(spec, tuple):
+            sessions.append((spec[0], int(spec[1])))
+            continue
+        spec_host, _, ports = str(spec).rpartition(':')
+        first, _, last = ports.partition('-')
+        for port in range(int(first), int(last or first) + 1):
+            sessions.append((spec_host or host, port))
+    return sessions
+
+
+class Session(asyncio.Protocol):
+    """The machine-readable side of one `Sdb` session.
+
+    Everything the session prints for humans is skipped; `QUERY_RESULT`
+    lines are matched to the `query()` that asked for them.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.closed = asyncio.get_event_loop().create_future()
+        self._buff = b''
+        self._ids = itertools.count(1)
+        self._waiters = {}
+
+    @property
+    def connected(self):
+        return self.transport is not None and not self.transport.is_closing()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._buff += data
+        prefix = QUERY_RESULT.encode('utf-8')
+        while b'\n' in self._buff:
+            line, self._buff = self._buff.split(b'\n', 1)
+            start = line.find(prefix)
+            if start < 0:
+                continue
+            result = json.loads(line[start + len(prefix):].decode('utf-8'))
+            waiter = self._waiters.pop(result.pop('id', None), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(result)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if not self.closed.done():
+            self.closed.set_result(None)
+        for waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.set_exception(
+                    exc or ConnectionResetError('session closed')
+                )
+        self._waiters.clear()
+
+    def query(self, expr, resume=False):
+        """Send `expr`; returns a future for the decoded result."""
+        ident = next(self._ids)
+        waiter = self._waiters[ident] = (
+            asyncio.get_event_loop().create_future()
+        )
+        request = json.dumps({'id': ident, 'expr': expr, 'resume': resume})
+        self.transport.write((QUERY + request + '\n').encode('utf-8'))
+        return waiter
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class SessionPool(object):
+    """Keeps connections to `Sdb` sessions open between queries.
+
+    Each session accepts a single client, so a pool holds on to it; at most
+    `max_connecting` connections are set up at the same time.  Closing the
+    pool (`close()`, then `await wait_closed()`) leaves the sessions paused,
+    waiting for their next client.
+    """
+
+    def __init__(self, max_connecting=64):
+        self.max_connecting = max_connecting
+        self._connecting = None
+        self._sessions = {}
+        self._closing = []
+
+    async def connect(self, host, port):
+        key = (host, port)
+        pending = self._sessions.get(key)
+        if pending is not None and pending.done() and (
+            pending.cancelled() or pending.exception() or
+            not pending.result().connected
+        ):
+            pending = None
+        if pending is None:
+            pending = self._sessions[key] = asyncio.ensure_future(
+                self._open(host, port)
+            )
+        return await asyncio.shield(pending)
+
+    async def _open(self, host, port):
+        if self._connecting is None:
+            self._connecting = asyncio.Semaphore(self.max_connecting)
+        async with self._connecting:
+            loop = asyncio.get_event_loop()
+            _, session = await loop.create_connection(Session, host, port)
+        return session
+
+    def discard(self, host, port):
+        pending = self._sessions.pop((host, port), None)
+        if pending is None:
+            return
+        if pending.done():
+            if not pending.cancelled() and not pending.exception():
+                pending.result().close()
+                self._closing.append(pending.result().closed)
+        else:
+            pending.cancel()
+
+    async def query_one(self, host, port, expr, timeout=5, resume=False):
+        """Evaluate `expr` in one session; returns a dict with ``ok`` and
+        either ``value``/``repr``/``truncated``/``type`` or ``error``."""
+        start = time.time()
+        result = {'session': '%s:%d' % (host, port)}
+
+        async def ask():
+            session = await self.connect(host, port)
+            return await session.query(expr, resume)
+
+        try:
+            result.update(await asyncio.wait_for(ask(), timeout))
+        except asyncio.TimeoutError:
+            result.update(ok=False, error='timed out after %gs' % timeout)
+            self.discard(host, port)
+        except OSError as exc:
+            result.update(ok=False, error='%s: %s' % (
+                type(exc).__name__, exc
+            ))
+            self.discard(host, port)
+        else:
+            if resume:
+                self.discard(host, port)
+        result['elapsed'] = time.time() - start
+        return result
+
+    async def query(self, sessions, expr, timeout=5, resume=False):
+        """Evaluate `expr` in every session concurrently; results come back
+        in the same order as `sessions` (see `parse_sessions`)."""
+        return await asyncio.gather(*(
+            self.query_one(host, port, expr, timeout, resume)
+            for host, port in parse_sessions(sessions)
+        ))
+
+    def close(self):
+        for key in list(self._sessions):
+            self.discard(*key)
+
+    async def wait_closed(self):
+        """Wait until every discarded session has let go of its socket."""
+        closing, self._closing = self._closing, []
+        await asyncio.gather(*closing)
+
+
+def query(sessions, expr, timeout=5, resume=False, max_connecting=64):
+    """Evaluate `expr` in many sessions at once (see `SessionPool.query`).
+
+    With `resume`, each worker continues once it has answered.
+    """
+    async def run():
+        pool = SessionPool(max_connecting)
+        try:
+            return await pool.query(sessions, expr, timeout, resume)
+        finally:
+            pool.close()
+            await pool.wait_closed()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def main(argv=None):
+    """`sdb-listen query`: print one JSON result per session."""
+    parser = argparse.ArgumentParser(
+        prog='sdb-listen query',
+        description='Evaluate an expression in many sdb sessions at once.',
+    )
+    parser.add_argument('expr')
+    parser.add_argument(
+        'sessions', nargs='+', metavar='session',
+        help='host:port, port, or host:first-last',
+    )
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='let each worker continue once it has answered',
+    )
+    parser.add_argument(
+        '--all', action='store_true',
+        help='include ports in a range that refused the connection',
+    )
+    args = parser.parse_args(argv)
+
+    results = [
+        result
+        for result in query(args.sessions, args.expr, args.timeout,
+                            args.resume)
+        if args.all or not result.get('error', '').startswith(
+            'ConnectionRefusedError'
+        )
+    ]
+    for result in results:
+        sys.stdout.write(json.dumps(result) + '\n')
+    return 0 if all(result['ok'] for result in results) else 1
@@ -29,7 +29,7 @@ setup(
         'Programming Language :: Python :: 3',
     ],
     install_requires=['pygments', 'six'],
-    py_modules=['sdb'],
+    py_modules=['sdb', 'sdb_client'],
     entry_points={
         'console_scripts': [
             'sdb = sdb:main',
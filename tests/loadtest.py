@@ -0,0 +1,372 @@
+"""Load test for session discovery and `sdb-listen`.
+
+Starts N processes that hit a breakpoint (using the real `Sdb` class) at
+a given arrival rate, and a listener that discovers and continues them with
+the code `sdb-listen` runs (its announcement consumer and `telnet` client,
+typed at through a pipe):
+
+    $ python -m tests.loadtest -n 200 --rate 50
+    $ python -m tests.loadtest -n 500 --rate 0 --clients 8 --json
+
+It reports port allocation latency and failures, announcement loss,
+time-to-connect percentiles, the listener's CPU time and memory, and how
+long workers were blocked.  It needs UDP port 6899, so stop any running
+`sdb-listen` first.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+
+from six.moves.queue import Empty, Queue
+
+import sdb
+
+
+class LoadTestSdb(sdb.Sdb):
+    """`Sdb` that reports when its port is bound and a client attached."""
+
+    worker = None
+    events = None
+
+    def get_avail_port(self, host, port, search_limit=100, skew=+0):
+        start = time.time()
+        try:
+            sock, this_port = super(LoadTestSdb, self).get_avail_port(
+                host, port, search_limit, skew
+            )
+        except Exception:
+            self.events.put(('failed', self.worker, start, time.time()))
+            raise
+        self.events.put(('bound', self.worker, start, time.time(), this_port))
+        return sock, this_port
+
+    def _accept(self):
+        super(LoadTestSdb, self)._accept()
+        self.events.put(('accepted', self.worker, time.time()))
+
+    def say(self, m):
+        pass
+
+
+class Keyboard(object):
+    """Stdin for `telnet`: a pipe that is read a key at a time, like the
+    terminal `sdb-listen` puts in cbreak mode."""
+
+    def __init__(self):
+        self._read, self._write = os.pipe()
+
+    def fileno(self):
+        return self._read
+
+    def read(self, size):
+        return os.read(self._read, size).decode('utf-8')
+
+    def type(self, keys):
+        os.write(self._write, keys.encode('utf-8'))
+
+
+class LoadTestTelnet(sdb.telnet):
+    """`telnet` whose user types `c` as soon as the session shows up."""
+
+    connected = None
+
+    def recv(self, data):
+        if self.connected is None:
+            self.connected = time.time()
+            self.stdin.type('c\n')
+        super(LoadTestTelnet, self).recv(data)
+
+
+def worker(index, offset, go, epoch, events, port):
+    """Hit a breakpoint `offset` seconds after the harness says go."""
+    LoadTestSdb.worker, LoadTestSdb.events = index, events
+    go.wait()
+    delay = epoch.value + offset - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    events.put(('hit', index, time.time()))
+    try:
+        debugger = LoadTestSdb(
+            notify_host='127.0.0.1', port=port, colorize=False,
+        )
+    except Exception as exc:
+        if str(exc) != sdb.NO_AVAILABLE_PORT:
+            raise
+        # reported by `get_avail_port`
+        return
+    debugger.set_trace()
+    events.put(('resumed', index, time.time()))
+
+
+def continue_session(port, timeout):
+    """Attach to the session at `port` and continue it; returns the time
+    the connection was made."""
+    sock = socket.create_connection(('127.0.0.1', port), timeout)
+    try:
+        connected = time.time()
+        sock.sendall(b'c\n')
+        while sock.recv(65536):
+            pass
+    finally:
+        sock.close()
+    return connected
+
+
+class Announcements(Queue):
+    """Stamps the ports `sdb-listen`'s consumer puts in it with the time
+    they were received."""
+
+    def put(self, item, *args, **kw):
+        Queue.put(self, (item, time.time()), *args, **kw)
+
+
+def listener(clients, timeout, ready, stop, results):
+    """Discover sessions from their announcements and continue them with
+    `clients` telnet clients, each one like a `sdb-listen` (which is a
+    single client)."""
+    start = resource.getrusage(resource.RUSAGE_SELF)
+    # `telnet` and the consumer print their progress
+    sys.stdout = open(os.devnull, 'w')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('0.0.0.0', sdb.NOTIFY_PORT))
+    announced = Announcements()
+    sessions, errors = [], []
+    consumer = threading.Thread(target=sdb._consume, args=(sock, announced))
+    consumer.daemon = True
+    consumer.start()
+    ready.set()
+
+    def attach():
+        keyboard = Keyboard()
+        while True:
+            try:
+                port, received = announced.get(timeout=0.1)
+            except Empty:
+                if stop.is_set():
+                    return
+                continue
+            client = LoadTestTelnet(int(port), keyboard, sys.stdout)
+            client.sock.settimeout(timeout)
+            try:
+                client.connect()
+            except (socket.error, socket.timeout) as exc:
+                errors.append('%s: %s' % (type(exc).__name__, exc))
+            else:
+                if client.connected is None:
+                    errors.append('unable to connect to :%s' % int(port))
+                else:
+                    sessions.append(client.connected - received)
+            finally:
+                client.sock.close()
+
+    threads = [threading.Thread(target=attach) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    results.put({
+        'received': len(sessions) + len(errors),
+        'queued': sessions,
+        'errors': errors,
+        'rcvbuf': rcvbuf,
+        'cpu_user': end.ru_utime - start.ru_utime,
+        'cpu_sys': end.ru_stime - start.ru_stime,
+        # kilobytes on Linux
+        'max_rss': end.ru_maxrss * 1024,
+    })
+
+
+def percentiles(values, points=(50, 90, 99, 100)):
+    """Nearest-rank percentiles of `values`, in milliseconds."""
+    values = sorted(values)
+    if not values:
+        return {}
+    return dict(
+        ('p%d' % p if p < 100 else 'max',
+         1000 * values[max(0, -(-p * len(values) // 100) - 1)])
+        for p in points
+    )
+
+
+def run(n=100, rate=50.0, clients=1, port=sdb.SDB_PORT, timeout=10.0):
+    """Run one load test; `rate` is breakpoints hit per second (0 hits them
+    all at once).  Returns the report as a dict."""
+    events = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    ready, stop, go = [multiprocessing.Event() for i in range(3)]
+    epoch = multiprocessing.Value('d', 0)
+
+    listen = multiprocessing.Process(
+        target=listener, args=(clients, timeout, ready, stop, results)
+    )
+    listen.start()
+    if not ready.wait(timeout):
+        raise RuntimeError('listener did not start')
+
+    workers = [
+        multiprocessing.Process(
+            target=worker,
+            args=(i, i / float(rate) if rate else 0, go, epoch, events, port),
+            # `Sdb` skews the port of processes named like `Process-3`,
+            # which would spread them out and hide the contention
+            name='loadtest worker %d' % i,
+        )
+        for i in range(n)
+    ]
+    for p in workers:
+        p.start()
+    epoch.value = time.time()
+    go.set()
+
+    hit, bound, failed, accepted, resumed = {}, {}, {}, {}, {}
+    rescued = 0
+    while len(resumed) + len(failed) < n:
+        try:
+            event = events.get(timeout=timeout)
+        except Empty:
+            if rescued:
+                break
+            # announcements that never arrived leave workers waiting for a
+            # client; continue them ourselves so that they can exit
+            waiting = set(bound) - set(resumed)
+            for index in waiting:
+                try:
+                    continue_session(bound[index][2], timeout)
+                except (socket.error, socket.timeout):
+                    pass
+            rescued = len(waiting) or -1
+            continue
+        kind, index = event[:2]
+        {'hit': hit, 'bound': bound, 'failed': failed, 'accepted': accepted,
+         'resumed': resumed}[kind][index] = event[2:]
+    wall = time.time() - epoch.value
+
+    stop.set()
+    listened = results.get(timeout=timeout)
+    listen.join(timeout)
+    for p in workers:
+        p.join(timeout)
+        if p.is_alive():
+            p.terminate()
+
+    return {
+        'workers': n,
+        'rate': rate,
+        'clients': clients,
+        'wall': wall,
+        'port_allocation': percentiles(
+            end - start for start, end, _ in bound.values()
+        ),
+        # NO_AVAILABLE_PORT: all of the ports searched were taken
+        'port_failures': len(failed),
+        'announcements': {
+            'sent': len(bound),
+            'received': listened['received'],
+            'lost': len(bound) - listened['received'],
+            'rescued': max(rescued, 0),
+            'rcvbuf': listened['rcvbuf'],
+        },
+        'time_to_connect': percentiles(
+            accepted[i][0] - hit[i][0] for i in accepted if i in hit
+        ),
+        'listener_queueing': percentiles(listened['queued']),
+        'client_errors': listened['errors'],
+        'listener': {
+            'cpu_user': listened['cpu_user'],
+            'cpu_sys': listened['cpu_sys'],
+            'max_rss': listened['max_rss'],
+        },
+        'blocked': percentiles(
+            resumed[i][0] - hit[i][0] for i in resumed if i in hit
+        ),
+        'stuck': n - len(resumed) - len(failed),
+    }
+
+
+def format_report(report):
+    def row(label, value):
+        return '%-24s%s' % (label, value)
+
+    def latency(values):
+        if not values:
+            return '-'
+        return '  '.join(
+            '%s %.1f' % (key, values[key])
+            for key in ('p50', 'p90', 'p99', 'max')
+        )
+
+    announcements = report['announcements']
+    listener = report['listener']
+    lines = [
+        row('workers', '%d (%s, %d client%s) in %.2fs' % (
+            report['workers'],
+            '%g/s' % report['rate'] if report['rate'] else 'all at once',
+            report['clients'], '' if report['clients'] == 1 else 's',
+            report['wall'],
+        )),
+        row('port allocation (ms)', latency(report['port_allocation'])),
+        row('no available port', report['port_failures']),
+        row('announcements', '%d sent, %d received, %d lost, '
+            '%d rescued (rcvbuf %d)' % (
+                announcements['sent'], announcements['received'],
+                announcements['lost'], announcements['rescued'],
+                announcements['rcvbuf'],
+            )),
+        row('time to connect (ms)', latency(report['time_to_connect'])),
+        row('listener queueing (ms)', latency(report['listener_queueing'])),
+        row('blocked (ms)', latency(report['blocked'])),
+        row('listener', 'cpu %.2fs user, %.2fs sys; max rss %.1fMB' % (
+            listener['cpu_user'], listener['cpu_sys'],
+            listener['max_rss'] / 1024.0 / 1024,
+        )),
+    ]
+    if report['client_errors']:
+        lines.append(row('client errors', len(report['client_errors'])))
+    if report['stuck']:
+        lines.append(row('stuck workers', report['stuck']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m tests.loadtest',
+        description='Load test session discovery and sdb-listen.',
+    )
+    parser.add_argument(
+        '-n', type=int, default=100, help='number of breakpoint processes',
+    )
+    parser.add_argument(
+        '--rate', type=float, default=50.0,
+        help='breakpoints hit per second (0 for all at once)',
+    )
+    parser.add_argument(
+        '--clients', type=int, default=1,
+        help='concurrent listener clients (sdb-listen uses 1)',
+    )
+    parser.add_argument('--port', type=int, default=sdb.SDB_PORT)
+    parser.add_argument(
+        '--timeout', type=float, default=10.0,
+        help='seconds without progress before giving up on a session',
+    )
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    report = run(args.n, args.rate, args.clients, args.port, args.timeout)
+    if args.json:
+        sys.stdout.write(json.dumps(report) + '\n')
+    else:
+        sys.stdout.write(format_report(report) + '\n')
+    return 0 if not report['stuck'] and not report['port_failures'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
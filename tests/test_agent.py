@@ -0,0 +1,259 @@
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import unittest
+
+import sdb
+
+
+class TestAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = sdb.Agent('127.0.0.1', 0)
+        self.agent.start()
+        self.stop = threading.Event()
+        self.worker = threading.Thread(
+            target=self.stop.wait, name='some-worker'
+        )
+        self.worker.start()
+
+    def tearDown(self):
+        self.stop.set()
+        self.worker.join()
+
+    def session(self, *commands):
+        client = socket.create_connection(('127.0.0.1', self.agent.port))
+        client.settimeout(5)
+        client.sendall(b''.join(c.encode('utf-8') + b'\n' for c in commands))
+        out = b''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            out += data
+        client.close()
+        return out.decode('utf-8')
+
+    def test_threads(self):
+        names = [name for _, _, name, _ in self.agent.threads()]
+        assert 'some-worker' in names
+        assert 'MainThread' in names
+        assert 'sdb-agent' not in names
+
+    def test_session_lists_threads(self):
+        out = self.session('quit')
+        assert '(some-worker):' in out
+        assert 'in wait' in out
+        assert 'break <n>' in out
+
+    def test_unknown_thread(self):
+        out = self.session('break 12345', 'quit')
+        assert '*** No such thread: 12345' in out
+
+    def test_break_into_unknown_thread(self):
+        self.assertRaises(ValueError, sdb.break_into, -1)
+
+    @unittest.skipIf(
+        hasattr(sys, 'monitoring'), 'Python < 3.12 only'
+    )
+    def test_break_into_other_thread(self):
+        self.assertRaises(
+            NotImplementedError, sdb.break_into, self.worker.ident
+        )
+
+    @unittest.skipIf(
+        hasattr(sys, 'monitoring'), 'Python < 3.12 only'
+    )
+    def test_break_into_main_thread_without_agent(self):
+        original = signal.signal(signal.SIGTRAP, signal.SIG_DFL)
+        try:
+            # the default action would kill the process
+            self.assertRaises(
+                RuntimeError, sdb.break_into,
+                threading.main_thread().ident,
+            )
+        finally:
+            signal.signal(signal.SIGTRAP, original)
+
+
+class TestAgentPort(unittest.TestCase):
+
+    def setUp(self):
+        # something else (say, another process's agent) holds the port
+        self.busy = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.busy.bind(('127.0.0.1', 0))
+        self.busy.listen(1)
+        self.port = self.busy.getsockname()[1]
+
+    def tearDown(self):
+        self.busy.close()
+
+    def test_next_free_port(self):
+        agent = sdb.Agent('127.0.0.1', self.port)
+        agent._sock.close()
+        assert agent.port > self.port
+
+    def test_no_available_port(self):
+        with self.assertRaises(Exception) as ctx:
+            sdb.Agent('127.0.0.1', self.port, port_search_limit=1)
+        assert 'SDB_AGENT_PORT' in str(ctx.exception)
+
+    def test_announced(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('127.0.0.1', 6899))
+        listener.settimeout(5)
+        try:
+            agent = sdb.Agent(
+                '127.0.0.1', self.port, notify_host='127.0.0.1'
+            )
+            agent._sock.close()
+            assert int(listener.recv(1024)) == agent.port
+        finally:
+            listener.close()
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'Python 3.7+')
+    def test_forked_child(self):
+        agent = sdb._agent[0] = sdb.Agent('127.0.0.1', self.port)
+        queue = multiprocessing.get_context('fork').Queue()
+
+        def child():
+            inherited = agent._sock.fileno()
+            started = sdb.Agent('127.0.0.1', self.port)
+            queue.put((sdb._agent[0], inherited, started.port))
+
+        try:
+            p = multiprocessing.get_context('fork').Process(target=child)
+            p.start()
+            forgotten, inherited, port = queue.get(timeout=5)
+            p.join(5)
+        finally:
+            sdb._agent[0] = None
+            agent._sock.close()
+        assert forgotten is None
+        assert inherited == -1
+        assert port not in (self.port, agent.port)
+
+
+class TestChainSigtrap(unittest.TestCase):
+
+    def setUp(self):
+        self.original = signal.getsignal(signal.SIGTRAP)
+        self.calls = []
+        signal.signal(
+            signal.SIGTRAP, lambda signum, frame: self.calls.append(signum)
+        )
+
+    def tearDown(self):
+        signal.signal(signal.SIGTRAP, self.original)
+        sdb._break_pending[0] = False
+
+    def test_previous_handler_kept(self):
+        sdb._chain_sigtrap({})
+        os.kill(os.getpid(), signal.SIGTRAP)
+        assert self.calls == [signal.SIGTRAP]
+
+    def test_chained_once(self):
+        sdb._chain_sigtrap({})
+        sdb._chain_sigtrap({})
+        os.kill(os.getpid(), signal.SIGTRAP)
+        assert self.calls == [signal.SIGTRAP]
+
+    def test_agent_signal_opens_session(self):
+        sessions = []
+
+        class FakeSdb(object):
+            def __init__(self, **kw):
+                sessions.append(kw)
+
+            def set_trace(self, frame):
+                pass
+
+        sdb._chain_sigtrap({'port': 1234})
+        real, sdb.Sdb = sdb.Sdb, FakeSdb
+        try:
+            sdb._break_pending[0] = True
+            os.kill(os.getpid(), signal.SIGTRAP)
+        finally:
+            sdb.Sdb = real
+        assert sessions == [{'port': 1234}]
+        assert self.calls == []
+        assert not sdb._break_pending[0]
+
+
+@unittest.skipUnless(hasattr(sys, 'monitoring'), 'Python 3.12+')
+class TestBreakInto(unittest.TestCase):
+
+    def setUp(self):
+        self.announcements = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.announcements.bind(('127.0.0.1', 6899))
+        self.stop = []
+        self.running = threading.Event()
+        self.worker = threading.Thread(target=self.spin)
+        self.worker.start()
+        self.running.wait(5)
+
+    def tearDown(self):
+        self.stop.append(True)
+        self.worker.join(5)
+        self.announcements.close()
+
+    def spin(self):
+        marker = 'in' + '-spin'  # noqa
+        self.running.set()
+        count = 0
+        # the session must open in this frame, not in the call it makes next
+        while not self.stopped():
+            count += 1
+
+    def stopped(self):
+        return bool(self.stop)
+
+    def read_until(self, client, text):
+        out = b''
+        while text.encode('utf-8') not in out:
+            data = client.recv(4096)
+            assert data, 'session closed'
+            out += data
+        return out.decode('utf-8')
+
+    def test_break_into_thread(self):
+        def tracer(frame, event, arg):
+            return None
+        previous = sys.gettrace()
+        sys.settrace(tracer)
+        try:
+            self.break_into()
+            # nothing but the worker's own tracer was replaced
+            assert sys.gettrace() is tracer
+        finally:
+            sys.settrace(previous)
+
+    def break_into(self):
+        while sys._current_frames()[self.worker.ident].f_code is not (
+            self.spin.__code__
+        ):
+            pass
+        sdb.break_into(
+            self.worker.ident, notify_host='127.0.0.1', colorize=False,
+            accept_timeout=10,
+        )
+        r, w, x = select.select([self.announcements], [], [], 10)
+        assert r, 'no announcement received'
+        port = int(self.announcements.recv(1024))
+        client = socket.create_connection(('127.0.0.1', port))
+        client.settimeout(10)
+        try:
+            self.read_until(client, 'spin()')
+            # the session is in the worker's own frame
+            client.sendall(b'p marker\n')
+            self.read_until(client, "'in-spin'")
+            self.stop.append(True)
+            client.sendall(b'c\n')
+        finally:
+            client.close()
+        self.worker.join(5)
+        assert not self.worker.is_alive()
@@ -0,0 +1,120 @@
+import multiprocessing
+import select
+import socket
+import unittest
+
+import six
+
+import sdb
+
+if six.PY3:
+    import sdb_client
+
+HOST = '127.0.0.1'
+
+
+@unittest.skipIf(six.PY2, 'sdb_client requires Python 3')
+class TestParseSessions(unittest.TestCase):
+
+    def test_host_and_port(self):
+        assert sdb_client.parse_sessions(['10.0.0.1:6900']) == [
+            ('10.0.0.1', 6900)
+        ]
+
+    def test_port_only(self):
+        assert sdb_client.parse_sessions(['6900'], host='h') == [('h', 6900)]
+
+    def test_range(self):
+        assert sdb_client.parse_sessions(['h:6900-6902']) == [
+            ('h', 6900), ('h', 6901), ('h', 6902)
+        ]
+
+    def test_tuple(self):
+        assert sdb_client.parse_sessions([('h', '6900')]) == [('h', 6900)]
+
+
+@unittest.skipIf(six.PY2, 'sdb_client requires Python 3')
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((HOST, 6899))
+        self.workers, self.sessions = [], []
+        for i in range(3):
+            p = multiprocessing.Process(target=self.set_trace, args=(i,))
+            p.start()
+            self.workers.append(p)
+        while len(self.sessions) < 3:
+            r, w, x = select.select([sock], [], [], 10)
+            assert r, 'no announcement received'
+            port = sock.recv(1024).decode('utf-8')
+            self.sessions.append('%s:%s' % (HOST, port))
+        sock.close()
+
+    def tearDown(self):
+        sdb_client.query(self.sessions, 'None', resume=True)
+        for p in self.workers:
+            p.join(5)
+
+    def set_trace(self, job_id):
+        batch = list(range(job_id))  # noqa
+        sdb.Sdb(notify_host=HOST, colorize=False).set_trace()
+
+    def test_query(self):
+        results = sdb_client.query(self.sessions, '(job_id, len(batch))')
+        assert [r['session'] for r in results] == self.sessions
+        assert sorted(r['value'] for r in results) == [
+            [0, 0], [1, 1], [2, 2]
+        ]
+        assert all(r['ok'] and r['type'] == 'tuple' for r in results)
+
+    def test_errors(self):
+        results = sdb_client.query(self.sessions, 'batch[1]')
+        errors = [r['error'] for r in results if not r['ok']]
+        assert errors == ['IndexError: list index out of range'] * 2
+
+    def test_truncated(self):
+        results = sdb_client.query(self.sessions, "'x' * 10000")
+        assert all(len(r['repr']) == sdb.QUERY_REPR_LIMIT for r in results)
+        assert all(r['truncated'] for r in results)
+        assert all('value' not in r for r in results)
+        short, = sdb_client.query(self.sessions[:1], 'job_id')
+        assert short['truncated'] is False and 'value' in short
+
+    def test_sessions_stay_paused(self):
+        sdb_client.query(self.sessions, 'job_id')
+        results = sdb_client.query(self.sessions, 'job_id')
+        assert all(r['ok'] for r in results)
+        assert all(p.is_alive() for p in self.workers)
+
+    def test_unreachable(self):
+        result, = sdb_client.query(['%s:1' % HOST], 'job_id', timeout=1)
+        assert result['ok'] is False
+        assert result['error'].startswith('ConnectionRefusedError')
+
+    def test_resume(self):
+        results = sdb_client.query(self.sessions, 'job_id', resume=True)
+        assert all(r['ok'] for r in results)
+        for p in self.workers:
+            p.join(5)
+            assert not p.is_alive()
+
+    def test_pool(self):
+        pool = sdb_client.SessionPool()
+
+        async def twice():
+            try:
+                first = await pool.query(self.sessions, 'job_id')
+                second = await pool.query(self.sessions, 'job_id * 2')
+            finally:
+                pool.close()
+                await pool.wait_closed()
+            return first, second
+        loop = sdb_client.asyncio.new_event_loop()
+        try:
+            first, second = loop.run_until_complete(twice())
+        finally:
+            loop.close()
+        assert [r['value'] * 2 for r in first] == [
+            r['value'] for r in second
+        ]
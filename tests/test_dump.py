@@ -0,0 +1,233 @@
+import array
+import multiprocessing
+import os
+import pickle
+import select
+import shutil
+import socket
+import tempfile
+import time
+from unittest import TestCase
+
+import six
+
+import sdb
+from sdb import DUMP_NONCE, DumpWriter, EvaluationInterrupted, telnet
+
+HOST = '127.0.0.1'
+
+
+class FakeSocket(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(bytes(data))
+
+
+class TestDump(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'out.bin')
+        self.sock = FakeSocket()
+        self.stdout = six.StringIO()
+        self.t = telnet(6899, six.StringIO(), self.stdout)
+        command = self.t.request_dump('dump obj ' + self.path)
+        self.nonce = command.split()[1][len(DUMP_NONCE):]
+
+    def tearDown(self):
+        self.t.sock.close()
+        shutil.rmtree(self.dir)
+
+    def deliver(self, size):
+        stream = b''.join(self.sock.sent)
+        for i in range(0, len(stream), size):
+            self.t.recv(stream[i:i + size])
+
+    def test_chunks_are_bounded(self):
+        writer = DumpWriter(self.sock, self.nonce, chunk_size=10)
+        writer.write(b'x' * 25)
+        writer.close()
+        assert self.sock.sent == [
+            b'<!DUMP!>' + self.nonce.encode('ascii') + b' -1\n',
+            b'<!CHUNK!>10\n', b'x' * 10,
+            b'<!CHUNK!>10\n', b'x' * 10,
+            b'<!CHUNK!>5\n', b'x' * 5,
+            b'<!CHUNK!>0\n',
+        ]
+        assert writer.sent == 25
+
+    def test_small_writes_coalesce(self):
+        writer = DumpWriter(self.sock, self.nonce, chunk_size=10)
+        for _ in range(4):
+            writer.write(b'ab')
+        writer.close()
+        assert self.sock.sent[1:] == [
+            b'<!CHUNK!>8\n', b'abababab', b'<!CHUNK!>0\n',
+        ]
+
+    def test_buffer_roundtrip(self):
+        data = array.array('d', range(1000))
+        view = memoryview(data).cast('B')
+        writer = DumpWriter(self.sock, self.nonce, len(view), chunk_size=512)
+        writer.write(view)
+        writer.close()
+        self.sock.sent.append(b'dumped 8000 bytes\n')
+        self.deliver(100)
+        with open(self.path, 'rb') as f:
+            assert f.read() == data.tobytes()
+        assert '8000/8000 bytes (100%)' in self.stdout.getvalue()
+        assert self.stdout.getvalue().endswith('dumped 8000 bytes\n>>> ')
+        assert self.t.dump is None
+
+    def test_pickle_roundtrip(self):
+        obj = {'a': list(range(10000)), 'b': b'x' * 100000}
+        writer = DumpWriter(self.sock, self.nonce, chunk_size=4096)
+        pickle.dump(obj, writer, protocol=pickle.HIGHEST_PROTOCOL)
+        writer.close()
+        assert max(len(chunk) for chunk in self.sock.sent) <= 4096
+        self.deliver(64)
+        with open(self.path, 'rb') as f:
+            assert pickle.load(f) == obj
+
+    def test_output_before_dump(self):
+        self.sock.sent.append(b'before\n')
+        writer = DumpWriter(self.sock, self.nonce)
+        writer.write(b'data')
+        writer.close()
+        self.deliver(1024)
+        assert self.stdout.getvalue().startswith('\nbefore\n>>> \x1b[2K')
+
+    def test_request(self):
+        command = self.t.request_dump('dump big[0] ' + self.path)
+        nonce = command.split()[1][len(DUMP_NONCE):]
+        assert command == 'dump %s%s big[0] %s' % (
+            DUMP_NONCE, nonce, self.path
+        )
+        assert len(nonce) == 16 and nonce != self.nonce
+
+    def test_marker_in_output_is_text(self):
+        self.t.recv(b"DUMP_HEADER = b'<!DUMP!>'\n")
+        self.t.recv(b'<!DUMP!>-1 /etc/passwd\n')
+        assert self.t.dump is None
+        assert "b'<!DUMP!>'" in self.stdout.getvalue()
+        assert '/etc/passwd' in self.stdout.getvalue()
+        assert not os.path.exists(self.path)
+
+    def test_marker_without_request_is_text(self):
+        self.t.dump_request = None
+        writer = DumpWriter(self.sock, self.nonce)
+        writer.write(b'data')
+        writer.close()
+        self.deliver(1024)
+        assert self.t.dump is None
+        assert not os.path.exists(self.path)
+
+    def test_path_comes_from_the_request(self):
+        # the session never tells the client where to write
+        writer = DumpWriter(self.sock, self.nonce, total=4)
+        writer.write(b'data')
+        writer.close()
+        assert self.path.encode('utf-8') not in self.sock.sent[0]
+        self.deliver(1024)
+        with open(self.path, 'rb') as f:
+            assert f.read() == b'data'
+
+    def test_header_split_between_reads(self):
+        self.sock.sent.append(b'before\n')
+        writer = DumpWriter(self.sock, self.nonce)
+        writer.write(b'data')
+        writer.close()
+        self.deliver(3)
+        with open(self.path, 'rb') as f:
+            assert f.read() == b'data'
+        assert '<!' not in self.stdout.getvalue()
+        assert self.t.dump_request is None
+
+    def test_interrupted_between_chunks(self):
+        writer = DumpWriter(
+            self.sock, self.nonce, chunk_size=10,
+            interrupted=lambda: len(self.sock.sent) > 3,
+        )
+        self.assertRaises(EvaluationInterrupted, writer.write, b'x' * 100)
+        writer.close()
+        assert self.sock.sent[1:] == [
+            b'<!CHUNK!>10\n', b'x' * 10,
+            b'<!CHUNK!>10\n', b'x' * 10,
+            b'<!CHUNK!>0\n',
+        ]
+        self.deliver(7)
+        assert self.t.dump is None
+        with open(self.path, 'rb') as f:
+            assert f.read() == b'x' * 20
+
+
+class TestDumpSession(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'out.bin')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((HOST, 6899))
+        self.worker = multiprocessing.Process(target=self.set_trace)
+        self.worker.start()
+        try:
+            r, w, x = select.select([sock], [], [], 10)
+            assert r, 'no announcement received'
+            self.port = int(sock.recv(1024))
+        finally:
+            sock.close()
+        self.stdout = six.StringIO()
+        self.t = telnet(self.port, six.StringIO(), self.stdout)
+        self.t.sock.connect((HOST, self.port))
+
+    def tearDown(self):
+        self.t.sock.close()
+        self.worker.join(5)
+        if self.worker.is_alive():
+            self.worker.terminate()
+        shutil.rmtree(self.dir)
+
+    def set_trace(self):
+        data = b'x' * (64 * 1024 * 1024)  # noqa
+        sdb.Sdb(notify_host=HOST, colorize=False).set_trace()
+
+    def command(self, line):
+        if line.startswith('dump '):
+            line = self.t.request_dump(line)
+        self.t.sock.sendall(line.encode('utf-8') + b'\n')
+
+    def read_until(self, text):
+        received = 0
+        while text not in self.stdout.getvalue():
+            data = self.t.sock.recv(65536)
+            assert data, 'session closed'
+            received += len(data)
+            self.t.recv(data)
+        return received
+
+    def test_interrupt(self):
+        # skip the listing (which includes this test's source)
+        self.command("p 'ready' + '!' * 3")
+        self.read_until('ready' + '!' * 3)
+        self.stdout.seek(0)
+        self.stdout.truncate()
+        self.command('dump data ' + self.path)
+        # let the stream get going (so that the command has been read, and
+        # the interrupt can't end up buffered with it), then interrupt it
+        while self.t.dump is None:
+            self.t.recv(self.t.sock.recv(65536))
+        self.t.sock.sendall(sdb.INTERRUPT)
+        # hold back while the worker fills the socket buffers, so that it
+        # sees the interrupt before the whole dump has gone through
+        time.sleep(0.5)
+        received = self.read_until('s, ' + 'interrupted]')
+        assert received < 64 * 1024 * 1024
+        assert self.t.dump is None and self.t.dump_request is None
+        assert 'dump interrupted after' in self.stdout.getvalue()
+        # the stream ended at a chunk boundary; the session carries on
+        self.command('p len(data) // 2')
+        self.read_until(str(32 * 1024 * 1024))
+        self.command('c')
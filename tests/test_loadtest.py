@@ -0,0 +1,56 @@
+import socket
+import unittest
+
+from tests import loadtest
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        values = [i / 1000.0 for i in range(1, 101)]
+        assert loadtest.percentiles(values) == {
+            'p50': 50, 'p90': 90, 'p99': 99, 'max': 100
+        }
+        assert loadtest.percentiles([]) == {}
+
+    def test_run(self):
+        report = loadtest.run(n=5, rate=0, timeout=5)
+        assert report['stuck'] == 0
+        assert report['announcements']['sent'] == 5
+        assert report['announcements']['lost'] == 0
+        assert report['port_failures'] == 0
+        assert report['client_errors'] == []
+        for key in ('port_allocation', 'time_to_connect', 'blocked'):
+            assert set(report[key]) == set(['p50', 'p90', 'p99', 'max'])
+        assert 'all at once' in loadtest.format_report(report)
+
+    def take_ports(self, count):
+        """Bind `count` consecutive ports; returns the sockets."""
+        while True:
+            taken = [socket.socket(socket.AF_INET, socket.SOCK_STREAM)]
+            taken[0].bind(('127.0.0.1', 0))
+            port = taken[0].getsockname()[1]
+            try:
+                for i in range(1, count):
+                    taken.append(socket.socket(socket.AF_INET,
+                                               socket.SOCK_STREAM))
+                    taken[-1].bind(('127.0.0.1', port + i))
+                return taken
+            except socket.error:
+                # something else has one of them; try another range
+                for sock in taken:
+                    sock.close()
+
+    def test_no_available_port(self):
+        # the whole range `Sdb` searches by default
+        taken = self.take_ports(100)
+        try:
+            report = loadtest.run(
+                n=2, rate=0, port=taken[0].getsockname()[1], timeout=5
+            )
+        finally:
+            for sock in taken:
+                sock.close()
+        assert report['port_failures'] == 2
+        assert report['stuck'] == 0
+        assert 'no available port' in loadtest.format_report(report)
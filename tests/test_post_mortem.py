@@ -0,0 +1,234 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+import sdb
+
+
+def fail(value):
+    raise ValueError(value)
+
+
+def other_fail():
+    raise KeyError('other')
+
+
+class TestPostMortem(TestCase):
+
+    def setUp(self):
+        class handler(sdb.PostMortem):
+            opened = []
+            release = threading.Event()
+
+            def open_session(self, tb):
+                self.opened.append(tb)
+                self.release.wait(5)
+
+        self.shared_dir = tempfile.mkdtemp()
+        self.handler = handler(max_sessions=2, shared_dir=self.shared_dir)
+        self.handler.release.set()
+
+    def tearDown(self):
+        shutil.rmtree(self.shared_dir)
+
+    def raise_into(self, handler, func, *args):
+        try:
+            func(*args)
+        except Exception:
+            return handler(*sys.exc_info())
+
+    def test_fingerprint_ignores_values(self):
+        keys = []
+        for value in (1, 2):
+            try:
+                fail(value)
+            except ValueError:
+                keys.append(sdb.fingerprint(sys.exc_info()[2]))
+        assert keys[0] == keys[1]
+        assert keys[0][-1][0] is fail.__code__
+
+    def test_duplicates_are_recorded(self):
+        assert self.raise_into(self.handler, fail, 1) is True
+        assert self.raise_into(self.handler, fail, 2) is False
+        assert len(self.handler.opened) == 1
+        snapshot, = self.handler.snapshots.values()
+        assert snapshot['count'] == 2
+        assert snapshot['debugged'] is True
+        assert snapshot['type'] == 'ValueError'
+        assert snapshot['message'] == '1'
+        assert snapshot['stack'][-1][2] == 'fail'
+
+    def test_max_sessions(self):
+        self.handler.max_sessions = 1
+        assert self.raise_into(self.handler, fail, 1) is True
+        assert self.raise_into(self.handler, other_fail) is False
+        assert len(self.handler.opened) == 1
+        assert len(self.handler.snapshots) == 2
+
+    def test_max_blocked(self):
+        self.handler.release.clear()
+        t = threading.Thread(
+            target=self.raise_into, args=(self.handler, fail, 1)
+        )
+        t.start()
+        while not self.handler.opened:
+            pass
+        try:
+            # a second, distinct failure while the first is still blocked
+            assert self.raise_into(self.handler, other_fail) is False
+        finally:
+            self.handler.release.set()
+            t.join()
+        assert len(self.handler.opened) == 1
+
+    def test_max_snapshots(self):
+        self.handler.max_snapshots = 1
+        self.raise_into(self.handler, fail, 1)
+        self.raise_into(self.handler, other_fail)
+        snapshot, = self.handler.snapshots.values()
+        assert snapshot['type'] == 'KeyError'
+
+    def test_debug_errors(self):
+        @sdb.debug_errors(self.handler)
+        def wrapped():
+            fail(1)
+        self.assertRaises(ValueError, wrapped)
+        assert len(self.handler.opened) == 1
+
+    def test_system_exit_ignored(self):
+        with self.assertRaises(SystemExit):
+            with sdb.debug_errors(self.handler):
+                sys.exit(1)
+        assert not self.handler.snapshots
+
+    def test_unusable_shared_dir(self):
+        # e.g., created by another user, or a mount that isn't there
+        self.handler.shared_dir = os.path.join(self.shared_dir, 'file', 'x')
+        open(os.path.join(self.shared_dir, 'file'), 'w').close()
+        with self.assertRaises(KeyError):
+            with sdb.debug_errors(self.handler):
+                other_fail()
+        # the process' own limits still apply
+        assert len(self.handler.opened) == 1
+        assert self.raise_into(self.handler, fail, 1) is True
+        assert self.raise_into(self.handler, fail, 2) is False
+
+    def test_session_error_is_not_raised(self):
+        def open_session(tb):
+            raise Exception(sdb.NO_AVAILABLE_PORT)
+        self.handler.open_session = open_session
+        with self.assertRaises(KeyError):
+            with sdb.debug_errors(self.handler):
+                other_fail()
+        assert self.raise_into(self.handler, fail, 1) is False
+
+    def test_default_dir_is_per_user(self):
+        assert str(os.getuid()) in os.path.basename(sdb.SDB_POST_MORTEM_DIR)
+
+    def test_shared_with_other_processes(self):
+        # another process (with its own handler) already debugged it
+        other = sdb.PostMortem(shared_dir=self.shared_dir)
+        other.open_session = lambda tb: None
+        assert self.raise_into(other, fail, 1) is True
+        assert self.raise_into(self.handler, fail, 2) is False
+        assert not self.handler.opened
+        snapshot, = self.handler.snapshots.values()
+        assert snapshot['debugged'] is False
+
+    def test_shared_max_sessions(self):
+        other = sdb.PostMortem(max_sessions=2, shared_dir=self.shared_dir)
+        other.open_session = lambda tb: None
+        assert self.raise_into(other, fail, 1) is True
+        assert self.raise_into(other, other_fail) is True
+        # a failure neither has seen, but the shared limit is used up
+        assert self.raise_into(self.handler, lambda: 1 / 0) is False
+
+    def test_window(self):
+        other = sdb.PostMortem(shared_dir=self.shared_dir)
+        other.open_session = lambda tb: None
+        self.raise_into(other, fail, 1)
+        self.handler.window = 0
+        assert self.raise_into(self.handler, fail, 2) is True
+
+    def test_shared_max_blocked(self):
+        self.handler.release.clear()
+        t = threading.Thread(
+            target=self.raise_into, args=(self.handler, fail, 1)
+        )
+        t.start()
+        while not self.handler.opened:
+            time.sleep(0.01)
+        try:
+            other = sdb.PostMortem(max_sessions=5, shared_dir=self.shared_dir)
+            other.open_session = lambda tb: None
+            assert self.raise_into(other, other_fail) is False
+        finally:
+            self.handler.release.set()
+            t.join()
+        assert self.raise_into(other, other_fail) is False
+        assert self.raise_into(other, lambda: 1 / 0) is True
+
+    def test_dead_blocker_is_dropped(self):
+        p = multiprocessing.Process(target=lambda: None)
+        p.start()
+        p.join()
+        with self.handler._shared_state() as state:
+            state['blocked']['%s:%d:1' % (socket.gethostname(), p.pid)] = (
+                time.time()
+            )
+        with self.handler._shared_state() as state:
+            assert state['blocked'] == {}
+
+    def test_fleet(self):
+        # every process hits the same error; only one of them blocks
+        handler = sdb.PostMortem(
+            shared_dir=self.shared_dir, accept_timeout=0.5,
+            notify_host=None, port_search_limit=1000,
+        )
+        results = multiprocessing.Queue()
+
+        def worker():
+            try:
+                fail(1)
+            except ValueError:
+                debugged = handler(*sys.exc_info())
+                snapshot, = handler.snapshots.values()
+                results.put((debugged, snapshot['timed_out']))
+        workers = [multiprocessing.Process(target=worker) for i in range(4)]
+        start = time.time()
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join(10)
+        # one waited for a client and timed out; the others didn't block
+        assert sorted(results.get(timeout=1) for p in workers) == [
+            (False, False), (False, False), (False, False), (False, True)
+        ]
+        assert time.time() - start < 5
+
+
+class TestAcceptTimeout(TestCase):
+
+    def test_resumes_without_client(self):
+        shared_dir = tempfile.mkdtemp()
+        try:
+            handler = sdb.PostMortem(
+                shared_dir=shared_dir, accept_timeout=0.2, notify_host=None,
+            )
+            start = time.time()
+            try:
+                fail(1)
+            except ValueError:
+                assert handler(*sys.exc_info()) is False
+            assert time.time() - start < 5
+            snapshot, = handler.snapshots.values()
+            assert snapshot['debugged'] is True
+            assert snapshot['timed_out'] is True
+        finally:
+            shutil.rmtree(shared_dir)
@@ -0,0 +1,111 @@
+import multiprocessing
+import select
+import socket
+import struct
+import time
+from unittest import TestCase
+
+import sdb
+
+HOST = '127.0.0.1'
+
+
+class SessionTest(TestCase):
+
+    budget = 0.2
+    reconnect = True
+
+    def setUp(self):
+        self.announcements = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.announcements.bind((HOST, 6899))
+        self.worker = multiprocessing.Process(target=self.set_trace)
+        self.worker.start()
+        self.port = self.announced()
+
+    def tearDown(self):
+        self.announcements.close()
+        self.worker.join(5)
+        if self.worker.is_alive():
+            self.worker.terminate()
+
+    def set_trace(self):
+        answer = 21  # noqa
+        sdb.Sdb(
+            notify_host=HOST, colorize=False, budget=self.budget,
+            reconnect=self.reconnect,
+        ).set_trace()
+
+    def announced(self):
+        r, w, x = select.select([self.announcements], [], [], 10)
+        assert r, 'no announcement received'
+        return int(self.announcements.recv(1024))
+
+    def connect(self):
+        client = socket.create_connection((HOST, self.port))
+        client.settimeout(10)
+        return client
+
+    def read_until(self, client, text):
+        out = b''
+        while text.encode('utf-8') not in out:
+            data = client.recv(4096)
+            assert data, 'session closed'
+            out += data
+        return out.decode('utf-8')
+
+    def finish(self):
+        client = self.connect()
+        client.sendall(b'p answer * 2\n')
+        self.read_until(client, str(42))
+        client.sendall(b'c\n')
+        client.close()
+        self.worker.join(5)
+        assert self.worker.exitcode == 0
+
+
+class TestReconnect(SessionTest):
+
+    def test_disconnect_past_budget(self):
+        client = self.connect()
+        client.close()
+        assert self.announced() == self.port
+        # no watchdog may be running while the session waits
+        time.sleep(self.budget * 3)
+        self.finish()
+
+    def test_reset(self):
+        client = self.connect()
+        client.sendall(b'p answer\n')
+        self.read_until(client, str(21))
+        # close with unread output (and SO_LINGER 0), so it's reset
+        client.sendall(b'p answer\n')
+        client.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0)
+        )
+        client.close()
+        assert self.announced() == self.port
+        self.finish()
+
+    def test_typeahead(self):
+        client = self.connect()
+        # the second line arrives before the first has been answered
+        client.sendall(b'p answer + 1\np answer + 2\n')
+        self.read_until(client, str(23))
+        client.close()
+        assert self.announced() == self.port
+        self.finish()
+
+
+class TestDisconnect(SessionTest):
+
+    reconnect = False
+
+    def test_resumes(self):
+        client = self.connect()
+        client.sendall(b'p answer\n')
+        self.read_until(client, str(21))
+        client.close()
+        self.worker.join(5)
+        assert self.worker.exitcode == 0
+        r, w, x = select.select([self.announcements], [], [], 0.2)
+        assert not r, 'announced again'
@@ -0,0 +1,90 @@
+import sys
+import threading
+from unittest import TestCase
+
+import six
+
+from sdb import ThreadRouter, _route, _unroute
+
+
+class TestThreadRouter(TestCase):
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        self.session = six.StringIO()
+        self.route = _route(six.StringIO(), self.session)
+
+    def tearDown(self):
+        if self.route is not None:
+            _unroute(self.route)
+
+    def test_routers_installed(self):
+        assert isinstance(sys.stdin, ThreadRouter)
+        assert isinstance(sys.stdout, ThreadRouter)
+        assert sys.stdout.stream is self.stdout
+
+    def test_current_thread_is_routed(self):
+        sys.stdout.write('to the session')
+        assert self.session.getvalue() == 'to the session'
+
+    def test_other_threads_pass_through(self):
+        other = six.StringIO()
+        sys.stdout.stream = other
+        try:
+            t = threading.Thread(target=lambda: sys.stdout.write('elsewhere'))
+            t.start()
+            t.join()
+        finally:
+            sys.stdout.stream = self.stdout
+        assert other.getvalue() == 'elsewhere'
+        assert self.session.getvalue() == ''
+
+    def test_nested_route(self):
+        inner = six.StringIO()
+        route = _route(six.StringIO(), inner)
+        sys.stdout.write('inner')
+        _unroute(route)
+        sys.stdout.write('outer')
+        assert inner.getvalue() == 'inner'
+        assert self.session.getvalue() == 'outer'
+
+    def test_unroute_restores_streams(self):
+        _unroute(self.route)
+        self.route = None
+        assert sys.stdout is self.stdout
+        assert not isinstance(sys.stdin, ThreadRouter)
+
+    def test_iterate_stdin_in_other_thread(self):
+        lines = []
+        stdin, sys.stdin.stream = sys.stdin.stream, six.StringIO('a\nb\n')
+        try:
+            t = threading.Thread(target=lambda: lines.extend(sys.stdin))
+            t.start()
+            t.join()
+        finally:
+            sys.stdin.stream = stdin
+        assert lines == ['a\n', 'b\n']
+
+    def test_iterate_routed_stdin(self):
+        route = _route(six.StringIO('x\ny\n'), six.StringIO())
+        try:
+            assert list(sys.stdin) == ['x\n', 'y\n']
+        finally:
+            _unroute(route)
+
+    def test_context_manager_in_other_thread(self):
+        other = six.StringIO()
+        sys.stdout.stream = other
+        entered = []
+
+        def run():
+            with sys.stdout as stream:
+                entered.append(stream)
+        try:
+            t = threading.Thread(target=run)
+            t.start()
+            t.join()
+        finally:
+            sys.stdout.stream = self.stdout
+        assert entered == [other]
+        assert other.closed
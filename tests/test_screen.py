@@ -0,0 +1,124 @@
+import re
+import sys
+from unittest import TestCase
+
+import six
+
+from sdb import Sdb, Screen, _WriteTracker
+
+
+class TestScreen(TestCase):
+
+    def setUp(self):
+        self.screen = Screen()
+        self.rows = ['%d  \tline %d' % (i, i) for i in range(1, 11)]
+        self.first = self.screen.render(('a.py', 1), 1, self.rows)
+
+    def test_first_render_is_full(self):
+        assert self.first.startswith('\x1b[H\x1b[2J')
+        assert self.first.endswith('10  \tline 10\n')
+
+    def test_unchanged(self):
+        out = self.screen.render(('a.py', 1), 1, self.rows)
+        assert out == '\x1b[11;1H\x1b[J'
+
+    def test_changed_rows_only(self):
+        rows = list(self.rows)
+        rows[4] = '5 ->\tline 5'
+        out = self.screen.render(('a.py', 1), 1, rows)
+        assert out == '\x1b[5;1H\x1b[2K5 ->\tline 5\x1b[11;1H\x1b[J'
+
+    def test_scroll(self):
+        rows = self.rows[2:] + ['11  \tline 11', '12  \tline 12']
+        out = self.screen.render(('a.py', 1), 3, rows)
+        assert out.startswith('\x1b[1;10r\x1b[2S\x1b[r')
+        assert 'line 11' in out and 'line 12' in out
+        assert 'line 10' not in out
+
+    def test_scroll_down(self):
+        rows = self.rows[4:] + ['x', 'y', 'z', 'w']
+        self.screen.render(('a.py', 1), 5, rows)
+        out = self.screen.render(('a.py', 1), 1, self.rows)
+        assert out.startswith('\x1b[1;10r\x1b[4T\x1b[r')
+        assert 'line 4' in out and 'line 5' not in out
+
+    def test_new_file_is_full(self):
+        out = self.screen.render(('b.py', 1), 1, self.rows)
+        assert out.startswith('\x1b[H\x1b[2J')
+
+    def test_new_frame_is_full(self):
+        out = self.screen.render(('a.py', 2), 1, self.rows)
+        assert out.startswith('\x1b[H\x1b[2J')
+
+    def test_large_jump_is_full(self):
+        out = self.screen.render(('a.py', 1), 50, self.rows)
+        assert out.startswith('\x1b[H\x1b[2J')
+
+    def test_fewer_rows(self):
+        out = self.screen.render(('a.py', 1), 1, self.rows[:5])
+        assert out == '\x1b[6;1H\x1b[J'
+
+    def test_output_invalidates(self):
+        stream = six.StringIO()
+        tracker = _WriteTracker(stream, self.screen)
+        tracker.write('*** NameError\n')
+        assert stream.getvalue() == '*** NameError\n'
+        out = self.screen.render(('a.py', 1), 1, self.rows)
+        assert out.startswith('\x1b[H\x1b[2J')
+
+
+class TestDeltaSession(TestCase):
+
+    def step(self, commands, height=None):
+        stdin, stdout = sys.stdin, sys.stdout
+        sys.stdin = six.StringIO(''.join(c + '\n' for c in commands))
+        sys.stdout = out = six.StringIO()
+        try:
+            debugger = Sdb(
+                notify_host=None, colorize=False, interactive=True,
+                delta=True,
+            )
+            if height is not None:
+                debugger.screen.height = height
+            try:
+                debugger.set_trace(sys._getframe())
+                total = 0
+                for i in range(3):
+                    total += i
+            finally:
+                debugger._sock.close()
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+        return out.getvalue()
+
+    def screens(self, output):
+        # what the client would display after each step: the listing plus
+        # the stack entry below it
+        return [
+            part for part in re.split(r'\x1b\[H\x1b\[2J', output) if part
+        ]
+
+    def test_listing_fits(self):
+        output = self.step(['n', 'n', 'c'], height=12)
+        first = self.screens(output)[0]
+        listing = first.split('\x1b[')[0].splitlines()
+        # listing, stack entry and prompt
+        assert len(listing) + 2 <= 12
+        assert any('->' in row for row in listing)
+
+    def test_steps_are_deltas(self):
+        output = self.step(['n', 'n', 'c'], height=12)
+        assert len(self.screens(output)) == 1
+        rows = [int(r) for r in re.findall(r'\x1b\[(\d+);1H', output)]
+        assert rows and max(rows) <= 12
+
+    def test_default_height(self):
+        output = self.step(['c'])
+        listing = self.screens(output)[0].splitlines()
+        assert len(listing) + 1 <= Screen().height
+
+    def test_too_small_to_fit(self):
+        output = self.step(['n', 'c'], height=2)
+        assert '\x1b[' not in output
+        assert '->\t                total = 0\n' in output
+        assert '->\t                for i in range(3):\n' in output
@@ -0,0 +1,125 @@
+import sys
+from collections import namedtuple
+from unittest import TestCase
+
+import six
+
+from sdb import Sdb, collapse_stack
+
+Frame = namedtuple('Frame', ['f_code'])
+
+
+def stack(names):
+    """Build a stack from 'name:lineno' strings."""
+    frames = []
+    for name in names:
+        code, lineno = name.split(':')
+        frames.append((Frame(code), int(lineno)))
+    return frames
+
+
+class TestCollapseStack(TestCase):
+
+    def test_no_recursion(self):
+        rows = collapse_stack(stack(['a:1', 'b:2', 'c:3']))
+        assert rows == [(0, 0, 1), (1, 1, 1), (2, 2, 1)]
+
+    def test_direct_recursion(self):
+        rows = collapse_stack(stack(['main:1'] + ['f:5'] * 100 + ['g:9']))
+        assert rows == [(0, 0, 1), (1, 100, 1), (101, 101, 1)]
+
+    def test_mutual_recursion(self):
+        frames = stack(['main:1'] + ['f:5', 'g:9'] * 50 + ['f:6'])
+        rows = collapse_stack(frames)
+        assert rows == [(0, 0, 1), (1, 100, 2), (101, 101, 1)]
+
+    def test_partial_cycle_is_left_alone(self):
+        frames = stack(['f:5', 'g:9'] * 3 + ['f:5'])
+        rows = collapse_stack(frames)
+        assert rows == [(0, 5, 2), (6, 6, 1)]
+
+    def test_short_runs_are_not_collapsed(self):
+        rows = collapse_stack(stack(['f:5', 'f:5', 'g:1']))
+        assert rows == [(0, 0, 1), (1, 1, 1), (2, 2, 1)]
+
+    def test_current_frame_is_never_folded(self):
+        rows = collapse_stack(stack(['f:5'] * 20), current=10)
+        assert rows == [(0, 9, 1), (10, 10, 1), (11, 19, 1)]
+
+    def test_deep_stack(self):
+        frames = stack(['main:1'] + ['f:5', 'g:9', 'h:3'] * 2000)
+        rows = collapse_stack(frames, current=len(frames) - 1)
+        assert rows == [
+            (0, 0, 1), (1, 5997, 3), (5998, 5998, 1), (5999, 5999, 1),
+            (6000, 6000, 1),
+        ]
+
+
+def recurse(depth):
+    if depth:
+        return recurse(depth - 1)
+    return sys._getframe()
+
+
+class TestWhere(TestCase):
+
+    def setUp(self):
+        self.debugger = Sdb(
+            notify_host=None, colorize=False, interactive=True,
+        )
+        self.debugger._sock.close()
+        self.debugger.context_lines = 5
+        self.debugger.stdout = six.StringIO()
+        self.frame = recurse(50)
+        self.debugger.reset()
+        self.debugger.setup(self.frame, None)
+        self.depth = len(self.debugger.stack)
+
+    def tearDown(self):
+        self.debugger.forget()
+
+    def where(self, arg=''):
+        self.debugger.stdout.seek(0)
+        self.debugger.stdout.truncate()
+        self.debugger.do_where(arg)
+        return self.debugger.stdout.getvalue().splitlines()
+
+    def test_current_page(self):
+        lines = self.where()
+        # the recursion is a single row; the current frame is last
+        cycle = [line for line in lines if 'cycle of recurse' in line]
+        assert len(cycle) == 1
+        assert lines[-1].startswith('> ') and 'recurse()' in lines[-1]
+        assert lines[0].startswith('  ... frames 0-')
+        assert lines[0].endswith('not shown (`where 0`)')
+
+    def test_where_n(self):
+        lines = self.where('0')
+        assert not lines[0].startswith('  ...')
+        # page on until the current frame shows up
+        pages = 1
+        while not lines[-1].startswith('> '):
+            assert lines[-1].startswith('  ... frames ')
+            following = lines[-1].split('`where ')[1][:-2]
+            assert lines[-1] == '  ... frames %s-%d not shown (`where %s`)' % (
+                following, self.depth - 1, following
+            )
+            lines = self.where(following)
+            assert lines[0] == '  ... frames 0-%d not shown (`where 0`)' % (
+                int(following) - 1
+            )
+            pages += 1
+        assert 1 < pages < self.depth
+
+    def test_invalid_frame(self):
+        for arg in ('-5', str(self.depth), 'x'):
+            assert self.where(arg) == ['*** Invalid frame (%s)' % arg]
+
+    def test_counted_up(self):
+        cmd, arg, line = self.debugger.parseline('2000up')
+        if six.PY3:
+            assert (cmd, arg) == ('up', '2000')
+            assert self.debugger.cmdqueue == []
+        else:
+            assert cmd == 'up'
+            assert len(self.debugger.cmdqueue) == 1999
@@ -0,0 +1,101 @@
+import socket
+import threading
+import time
+from unittest import TestCase
+
+from sdb import EvaluationInterrupted, Watchdog, _get_ident
+
+
+class TestWatchdog(TestCase):
+
+    def spin(self, watchdog, timeout=5):
+        end = time.time() + timeout
+        try:
+            watchdog.start()
+            while time.time() < end:
+                pass
+        except EvaluationInterrupted:
+            return True
+        finally:
+            watchdog.stop()
+        return False
+
+    def test_budget(self):
+        watchdog = Watchdog(_get_ident(), budget=0.1)
+        assert self.spin(watchdog) is True
+        assert watchdog.fired == 'budget of 0.1s exceeded'
+
+    def test_deferred(self):
+        watchdog = Watchdog(_get_ident(), budget=0.1)
+        watchdog.defer()
+        assert self.spin(watchdog, timeout=0.5) is False
+        assert watchdog.fired == 'budget of 0.1s exceeded'
+
+    def test_stop_before_budget(self):
+        watchdog = Watchdog(_get_ident(), budget=0.5)
+        watchdog.start()
+        watchdog.stop()
+        watchdog.join()
+        assert watchdog.fired is None
+
+    def test_interrupt_message(self):
+        server, client = socket.socketpair()
+        try:
+            watchdog = Watchdog(_get_ident(), sock=server)
+            client.sendall(b'<!INT!>\nnext\n')
+            assert self.spin(watchdog) is True
+            assert watchdog.fired == 'interrupted'
+            # only the interrupt is consumed
+            assert server.recv(64) == b'next\n'
+        finally:
+            server.close()
+            client.close()
+
+    def test_telnet_interrupt(self):
+        server, client = socket.socketpair()
+        try:
+            watchdog = Watchdog(_get_ident(), sock=server)
+            client.sendall(b'\xff\xf4\xff\xfd\x06')
+            assert self.spin(watchdog) is True
+            assert watchdog.fired == 'interrupted'
+        finally:
+            server.close()
+            client.close()
+
+    def test_other_input_is_left_alone(self):
+        server, client = socket.socketpair()
+        try:
+            watchdog = Watchdog(_get_ident(), sock=server)
+            client.sendall(b'p x\n')
+            threading.Timer(0.2, watchdog.stop).start()
+            assert self.spin(watchdog, timeout=0.5) is False
+            assert watchdog.fired is None
+            assert server.recv(64) == b'p x\n'
+        finally:
+            server.close()
+            client.close()
+
+    def test_disconnect_is_not_an_interrupt(self):
+        server, client = socket.socketpair()
+        try:
+            watchdog = Watchdog(_get_ident(), sock=server)
+            client.close()
+            threading.Timer(0.2, watchdog.stop).start()
+            assert self.spin(watchdog, timeout=0.5) is False
+            assert watchdog.fired is None
+        finally:
+            server.close()
+
+    def test_stopped_leaves_interrupt_for_next_command(self):
+        server, client = socket.socketpair()
+        try:
+            watchdog = Watchdog(_get_ident(), sock=server)
+            watchdog.stop()
+            # e.g., seen by the previous command's watchdog as it stops
+            client.sendall(b'<!INT!>\n')
+            watchdog.fire('interrupted', len(b'<!INT!>\n'))
+            assert watchdog.fired is None
+            assert server.recv(64) == b'<!INT!>\n'
+        finally:
+            server.close()
+            client.close()